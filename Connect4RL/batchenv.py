@@ -0,0 +1,120 @@
+import functools
+
+import numpy as np
+
+from engine import window_index_table
+
+
+# Helper function for BatchEnv: for every cell, the windows through it as flat board
+# indices, padded to the same number of windows; valid marks the real ones
+@functools.lru_cache(maxsize=None)
+def cell_line_table(rows, columns, inarow):
+    windows = window_index_table(rows, columns, inarow)
+    per_cell = [[window for window in windows if cell in window] for cell in range(rows * columns)]
+    width = max(1, max(len(cell_windows) for cell_windows in per_cell))
+    lines = np.zeros((rows * columns, width, inarow), dtype=np.intp)
+    valid = np.zeros((rows * columns, width), dtype=bool)
+    for cell, cell_windows in enumerate(per_cell):
+        if cell_windows:
+            lines[cell, :len(cell_windows)] = cell_windows
+            valid[cell, :len(cell_windows)] = True
+    lines.flags.writeable = False
+    valid.flags.writeable = False
+    return lines, valid
+
+
+class BatchEnv:
+    """N Connect Four games stepped together with array operations.
+
+    boards is an (N, rows, columns) int8 array in the engine's layout (row 0 on top,
+    1 and 2 for the players' pieces); marks holds the player to move in every game.
+    step() plays one column per game, checks only the windows through the new piece
+    for a win, and with auto_reset starts finished games over, so all N games are
+    always in play. Without auto_reset, finished games ignore their actions until
+    reset() is called for them.
+    """
+
+    def __init__(self, num_games, config, auto_reset=True):
+        self.num_games = num_games
+        self.rows = config.rows
+        self.columns = config.columns
+        self.cells = config.rows * config.columns
+        self.auto_reset = auto_reset
+        self.lines, self.valid = cell_line_table(config.rows, config.columns, config.inarow)
+        self.boards = np.zeros((num_games, config.rows, config.columns), dtype=np.int8)
+        self.heights = np.zeros((num_games, config.columns), dtype=np.int16)
+        self.marks = np.ones(num_games, dtype=np.int8)
+        self.moves = np.zeros(num_games, dtype=np.int16)
+        self.done = np.zeros(num_games, dtype=bool)
+        self.games = np.arange(num_games)
+
+    # Empties the given games (a bool mask or indices; all games if None) and returns the boards
+    def reset(self, games=None):
+        games = slice(None) if games is None else games
+        self.boards[games] = 0
+        self.heights[games] = 0
+        self.marks[games] = 1
+        self.moves[games] = 0
+        self.done[games] = False
+        return self.boards
+
+    # (N, columns) bool array of the columns that are not full (none for finished games)
+    def legal_mask(self):
+        return (self.heights < self.rows) & ~self.done[:, None]
+
+    # One uniformly random legal column per game (-1 for finished games)
+    def random_actions(self, rng=np.random):
+        mask = self.legal_mask()
+        actions = np.argmax(rng.random(mask.shape) * mask, axis=1)
+        actions[~mask.any(axis=1)] = -1
+        return actions
+
+    def step(self, actions):
+        """
+        Plays actions[i] for the player to move in every unfinished game.
+
+        Returns (boards, rewards, dones, info). rewards are for the player who just moved:
+        1 for a win, -1 for an illegal column (which loses the game), 0 otherwise.
+        info["winner"] holds 1 or 2 for won games, 0 otherwise, info["draw"] marks full boards
+        and, with auto_reset, info["final_boards"] holds the finished boards before the reset
+        (in the order of np.flatnonzero(dones)).
+        """
+        actions = np.asarray(actions)
+        active = ~self.done
+        movers = self.marks.copy()
+        in_range = (actions >= 0) & (actions < self.columns)
+        cols = np.where(in_range, actions, 0)
+        heights = self.heights[self.games, cols]
+        legal = active & in_range & (heights < self.rows)
+        illegal = active & ~legal
+
+        games, cols, heights = self.games[legal], cols[legal], heights[legal]
+        rows = self.rows - 1 - heights
+        marks = movers[legal]
+        self.boards[games, rows, cols] = marks
+        self.heights[games, cols] = heights + 1
+        self.moves[games] += 1
+
+        # only windows through the new piece can have been completed
+        cells = rows * self.columns + cols
+        flat = self.boards.reshape(self.num_games, -1)
+        windows = flat[games[:, None, None], self.lines[cells]]
+        won = ((windows == marks[:, None, None]).all(axis=2) & self.valid[cells]).any(axis=1)
+
+        winner = np.zeros(self.num_games, dtype=np.int8)
+        winner[games[won]] = marks[won]
+        winner[illegal] = movers[illegal] % 2 + 1
+        draw = np.zeros(self.num_games, dtype=bool)
+        draw[games[~won]] = self.moves[games[~won]] == self.cells
+        rewards = np.zeros(self.num_games, dtype=np.float32)
+        rewards[games[won]] = 1
+        rewards[illegal] = -1
+        dones = (winner > 0) | draw
+
+        self.marks[active] = movers[active] % 2 + 1
+        self.done |= dones
+        info = {"winner": winner, "draw": draw}
+        if self.auto_reset and dones.any():
+            info["final_boards"] = self.boards[dones].copy()
+            self.reset(dones)
+        return self.boards, rewards, dones, info
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+import engine
+from bitboard import Position
+from search import Searcher
+from stats import percentiles
+from transposition import TranspositionTable
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_positions.txt")
+CONFIG = types.SimpleNamespace(rows=6, columns=7, inarow=4)   # the corpus is for the standard board
+TOLERANCE = 0.15   # Relative slowdown against the baseline that counts as a regression
+
+
+# Helper function for bench: reads the corpus as a list of (phase, position, grid, mark to move)
+def load_corpus(path=CORPUS_PATH, config=CONFIG):
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            phase, moves = line.split()
+            position = Position(config, incremental=True)
+            for i, col in enumerate(moves):
+                position.play(int(col), i % 2 + 1)
+            corpus.append((phase, position, position.to_grid(), position.num_moves() % 2 + 1))
+    return corpus
+
+
+# Helper function for bench: calls func over items repeatedly for at least min_time seconds
+# and returns calls per second
+def rate(func, items, min_time):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for item in items:
+            func(item)
+        calls += len(items)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+
+def bench_evaluation(corpus, config, min_time):
+    grids = [grid for _, _, grid, _ in corpus]
+    positions = [position for _, position, _, _ in corpus]
+    return {
+        "get_heuristic_per_sec": rate(lambda grid: engine.get_heuristic(grid, 1, config), grids, min_time),
+        "count_windows_per_sec": rate(lambda grid: engine.count_windows(grid, 3, 1, config), grids, min_time),
+        "is_terminal_node_per_sec": rate(lambda grid: engine.is_terminal_node(grid, config), grids, min_time),
+        "position_heuristic_per_sec": rate(lambda position: position.heuristic(1), positions, min_time),
+    }
+
+
+# Alpha-beta root search of every corpus position with a fresh table: latency and nodes/sec
+def bench_alphabeta(corpus, config, depths):
+    results = {}
+    for depth in depths:
+        times, nodes = [], 0
+        for _, position, _, mark in corpus:
+            searcher = Searcher(mark, config, TranspositionTable(engine.TT_MEGABYTES))
+            position = position.copy()
+            start = time.perf_counter()
+            searcher.root_scores(position, depth, exact=False)
+            times.append(time.perf_counter() - start)
+            nodes += searcher.nodes
+        results["depth%d" % depth] = dict(percentiles(times), nodes=nodes, nodes_per_sec=nodes / sum(times))
+    return results
+
+
+# Full-tree search of every valid column through score_move ("minimax" or "batched"): latency
+def bench_minimax(corpus, config, depths, search):
+    results = {}
+    for depth in depths:
+        times = []
+        for _, position, grid, mark in corpus:
+            start = time.perf_counter()
+            for col in position.valid_moves():
+                engine.score_move(grid, col, mark, config, depth, search)
+            times.append(time.perf_counter() - start)
+        results["depth%d" % depth] = percentiles(times)
+    return results
+
+
+# agent with its default settings (book, endgame solver, N_STEPS search), one call per position
+def bench_agent(corpus, config):
+    times = {}
+    for phase, _, grid, mark in corpus:
+        obs = types.SimpleNamespace(board=grid.flatten().tolist(), mark=mark)
+        start = time.perf_counter()
+        engine.agent(obs, config)
+        times.setdefault(phase, []).append(time.perf_counter() - start)
+    results = {phase: percentiles(samples) for phase, samples in times.items()}
+    results["all"] = percentiles([t for samples in times.values() for t in samples])
+    return results
+
+
+# Peak traced Python memory of one agent call, worst case over the corpus
+def bench_memory(corpus, config):
+    peak = 0
+    for _, _, grid, mark in corpus:
+        obs = types.SimpleNamespace(board=grid.flatten().tolist(), mark=mark)
+        tracemalloc.start()
+        engine.agent(obs, config)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"agent_peak_bytes": peak}
+
+
+# Cold start: seconds to import each module in a fresh interpreter, which is what every
+# new worker process pays before its first move
+def bench_coldstart(runs, modules=("engine", "trainC4")):
+    code = "import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)"
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        times = [float(subprocess.run([sys.executable, "-c", code % module], cwd=directory, check=True,
+                                      capture_output=True, text=True).stdout)
+                 for _ in range(runs)]
+        results[module + "_import"] = percentiles(times)
+    return results
+
+
+def bench(corpus_path=CORPUS_PATH, depths=(1, 2, 3, 4), minimax_depths=(1, 2, 3), min_time=0.5, coldstart_runs=5):
+    """Runs every benchmark on the corpus and returns the results as a JSON-ready dict"""
+    config = CONFIG
+    corpus = load_corpus(corpus_path, config)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "positions": len(corpus),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "evaluation": bench_evaluation(corpus, config, min_time),
+        "alphabeta": bench_alphabeta(corpus, config, depths),
+        "minimax": bench_minimax(corpus, config, minimax_depths, "minimax"),
+        "batched": bench_minimax(corpus, config, minimax_depths, "batched"),
+        "agent": bench_agent(corpus, config),
+        "memory": bench_memory(corpus, config),
+        "coldstart": bench_coldstart(coldstart_runs),
+    }
+
+
+# Helper function for compare: nested results as {"section.key.metric": value}
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if key == "meta":
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Returns the metrics that got worse than baseline by more than tolerance, as a list of
+    (metric, baseline value, new value). Rates (*_per_sec) should not drop; latencies,
+    node counts and memory should not grow.
+    """
+    new, old = flatten(results), flatten(baseline)
+    regressions = []
+    for metric, before in sorted(old.items()):
+        after = new.get(metric)
+        if after is None or before == 0:
+            continue
+        if metric.endswith("_per_sec"):
+            worse = after < before * (1 - tolerance)
+        else:
+            worse = after > before * (1 + tolerance)
+        if worse:
+            regressions.append((metric, before, after))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the search and evaluation functions on a fixed corpus")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 2, 3, 4], help="alpha-beta depths")
+    parser.add_argument("--minimax-depths", type=int, nargs="+", default=[1, 2, 3], help="full-tree search depths")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds per evaluation-rate measurement")
+    parser.add_argument("--coldstart-runs", type=int, default=5, help="fresh interpreters per import timing")
+    parser.add_argument("--out", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    results = bench(args.corpus, args.depths, args.minimax_depths, args.min_time, args.coldstart_runs)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Wrote", args.out)
+    for metric, value in flatten(results).items():
+        print("%-40s %.6g" % (metric, value))
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for metric, before, after in regressions:
+            print("REGRESSION %s: %.6g -> %.6g" % (metric, before, after))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
@@ -0,0 +1,351 @@
+import functools
+import random
+
+import numpy as np
+
+
+# Bit layout: every column takes config.rows + 1 bits, bottom cell first, so the
+# cell (row, col) of a grid (row 0 at the top) lives at bit col*(rows+1) + (rows-1-row).
+# The extra bit at the top of each column is always empty; it stops horizontal and
+# diagonal runs from wrapping into the next column when the masks are shifted.
+# For the standard 6x7 board both masks fit in 49 bits; Python ints handle larger
+# configs transparently.
+
+
+# Helper function for Position: precomputes the masks that only depend on the board size
+@functools.lru_cache(maxsize=None)
+def board_tables(rows, columns, inarow):
+    height = rows + 1
+    # shift for vertical, horizontal, positive diagonal and negative diagonal lines
+    directions = (1, height, height + 1, height - 1)
+    # cells where a window of length inarow can start for each direction
+    starts = []
+    for direction in directions:
+        start_mask = 0
+        for col in range(columns):
+            for row in range(rows):
+                if direction == 1:
+                    fits = row + inarow <= rows
+                elif direction == height:
+                    fits = col + inarow <= columns
+                elif direction == height + 1:
+                    fits = col + inarow <= columns and row + inarow <= rows
+                else:
+                    fits = col + inarow <= columns and row - (inarow - 1) >= 0
+                if fits:
+                    start_mask |= 1 << (col * height + row)
+        starts.append(start_mask)
+    # one mask per window, 69 of them on the standard board
+    windows = []
+    for direction, start_mask in zip(directions, starts):
+        for bit in range(columns * height):
+            if (start_mask >> bit) & 1:
+                windows.append(sum(1 << (bit + k * direction) for k in range(inarow)))
+    bottom = sum(1 << (col * height) for col in range(columns))
+    column_masks = [((1 << rows) - 1) << (col * height) for col in range(columns)]
+    board_mask = sum(column_masks)
+    return directions, tuple(windows), bottom, tuple(column_masks), board_mask
+
+
+# Helper function for Position: random 64-bit Zobrist keys, one per (mark, bit) and one per
+# mark for the side the search is played for. Seeded, so hashes are stable between runs
+# and processes.
+@functools.lru_cache(maxsize=None)
+def zobrist_keys(rows, columns, seed=20240607):
+    rng = random.Random(seed)
+    bits = columns * (rows + 1)
+    cells = tuple(tuple(rng.getrandbits(64) for _ in range(bits)) for _ in range(3))
+    marks = tuple(rng.getrandbits(64) for _ in range(3))
+    return cells, marks
+
+
+# Helper function for Position: for every bit, the bit of the same cell in the left-right mirror
+@functools.lru_cache(maxsize=None)
+def mirror_bits(rows, columns):
+    height = rows + 1
+    return tuple((columns - 1 - bit // height) * height + bit % height for bit in range(columns * height))
+
+
+# Swaps column col with column columns-1-col in a bitboard whose columns are height bits each
+def mirror_mask(mask, columns, height):
+    mirrored = 0
+    column_bits = (1 << height) - 1
+    for col in range(columns):
+        bits = (mask >> (col * height)) & column_bits
+        mirrored |= bits << ((columns - 1 - col) * height)
+    return mirrored
+
+
+# Helper function for Position: checks whether a bitboard contains inarow pieces in a line
+def has_line(mask, directions, inarow):
+    for direction in directions:
+        run = mask
+        for k in range(1, inarow):
+            run &= mask >> (k * direction)
+            if not run:
+                break
+        if run:
+            return True
+    return False
+
+
+# Empty cells where one more piece of the player owning `own` would complete a line
+# (mask holds every piece on the board, board_mask every real cell)
+def winning_cells(own, mask, directions, inarow, board_mask):
+    cells = 0
+    for direction in directions:
+        # ahead[k]: cells with k pieces in a row after them, behind[k]: k pieces before them
+        ahead, behind = [-1], [-1]
+        for k in range(1, inarow):
+            ahead.append(ahead[-1] & (own >> (k * direction)))
+            behind.append(behind[-1] & (own << (k * direction)))
+        for hole in range(inarow):
+            cells |= ahead[inarow - 1 - hole] & behind[hole]
+    return cells & board_mask & ~mask
+
+
+# Helper function for IncrementalEvaluator: indices of the windows passing through each bit
+# (at most 16 per cell for inarow=4), indexed like the bitboards
+@functools.lru_cache(maxsize=None)
+def cell_window_table(rows, columns, inarow):
+    windows = board_tables(rows, columns, inarow)[1]
+    return tuple(tuple(index for index, window in enumerate(windows) if (window >> bit) & 1)
+                 for bit in range(columns * (rows + 1)))
+
+
+class IncrementalEvaluator:
+    """Window counts of a Position kept up to date move by move.
+
+    counts[m][n] is the number of windows holding n pieces of mark m and none of the
+    other mark, the same numbers engine.count_windows computes from scratch. A move
+    only touches the windows through its cell, and a window reaching inarow pieces is
+    remembered in `lines`, so wins are detected from the last move alone.
+    """
+
+    def __init__(self, config):
+        self.inarow = config.inarow
+        self.cell_windows = cell_window_table(config.rows, config.columns, config.inarow)
+        num_windows = len(board_tables(config.rows, config.columns, config.inarow)[1])
+        size = max(config.inarow, 4) + 1
+        self.pieces = [None, [0] * num_windows, [0] * num_windows]  # pieces[m][w]
+        self.counts = [None, [num_windows] + [0] * (size - 1), [num_windows] + [0] * (size - 1)]
+        self.lines = 0  # completed windows on the board
+
+    def copy(self):
+        other = IncrementalEvaluator.__new__(IncrementalEvaluator)
+        other.inarow = self.inarow
+        other.cell_windows = self.cell_windows
+        other.pieces = [None, list(self.pieces[1]), list(self.pieces[2])]
+        other.counts = [None, list(self.counts[1]), list(self.counts[2])]
+        other.lines = self.lines
+        return other
+
+    def add(self, bit, mark):
+        own, opp = self.pieces[mark], self.pieces[mark%2+1]
+        own_counts, opp_counts = self.counts[mark], self.counts[mark%2+1]
+        for window in self.cell_windows[bit]:
+            n = own[window]
+            o = opp[window]
+            if o == 0:
+                own_counts[n] -= 1
+                own_counts[n+1] += 1
+                if n+1 == self.inarow:
+                    self.lines += 1
+            if n == 0:
+                opp_counts[o] -= 1
+            own[window] = n+1
+
+    def remove(self, bit, mark):
+        own, opp = self.pieces[mark], self.pieces[mark%2+1]
+        own_counts, opp_counts = self.counts[mark], self.counts[mark%2+1]
+        for window in self.cell_windows[bit]:
+            n = own[window] - 1
+            o = opp[window]
+            if o == 0:
+                own_counts[n+1] -= 1
+                own_counts[n] += 1
+                if n+1 == self.inarow:
+                    self.lines -= 1
+            if n == 0:
+                opp_counts[o] += 1
+            own[window] = n
+
+
+class Position:
+    """Connect Four position stored as one bitboard per player plus column heights.
+
+    Moves are applied and undone in place in O(1), which lets the search walk the
+    game tree without copying the grid at every node. With incremental=True an
+    IncrementalEvaluator follows every move, making heuristic() and is_terminal()
+    O(1) at the price of updating the windows through the played cell.
+    """
+
+    def __init__(self, config, incremental=False):
+        self.rows = config.rows
+        self.columns = config.columns
+        self.inarow = config.inarow
+        self.height = config.rows + 1
+        (self.directions, self.windows, self.bottom,
+         self.column_masks, self.board_mask) = board_tables(config.rows, config.columns, config.inarow)
+        self.masks = [0, 0, 0]  # indexed by mark, masks[0] is unused
+        self.heights = [0] * config.columns
+        self.history = []  # stack of (col, mark) for undo
+        self.zobrist, self.mark_keys = zobrist_keys(config.rows, config.columns)
+        self.hash = 0  # Zobrist hash of the pieces, updated incrementally by play/undo
+        self.mirror = mirror_bits(config.rows, config.columns)
+        self.mirror_hash = 0  # Zobrist hash of the left-right mirror of the pieces
+        self.evaluator = IncrementalEvaluator(config) if incremental else None
+        self.config = config
+
+    @classmethod
+    def from_grid(cls, grid, config, incremental=False):
+        position = cls(config, incremental)
+        for col in range(config.columns):
+            for row in range(config.rows - 1, -1, -1):
+                piece = int(grid[row][col])
+                if piece == 0:
+                    break
+                position.play(col, piece)
+        position.history = []
+        return position
+
+    @classmethod
+    def from_board(cls, board, config, incremental=False):
+        grid = np.asarray(board).reshape(config.rows, config.columns)
+        return cls.from_grid(grid, config, incremental)
+
+    def copy(self):
+        other = Position.__new__(Position)
+        other.__dict__.update(self.__dict__)
+        other.masks = list(self.masks)
+        other.heights = list(self.heights)
+        other.history = list(self.history)
+        if self.evaluator is not None:
+            other.evaluator = self.evaluator.copy()
+        return other
+
+    def can_play(self, col):
+        return self.heights[col] < self.rows
+
+    def valid_moves(self):
+        return [col for col in range(self.columns) if self.heights[col] < self.rows]
+
+    def play(self, col, mark):
+        bit = col * self.height + self.heights[col]
+        self.masks[mark] |= 1 << bit
+        self.hash ^= self.zobrist[mark][bit]
+        self.mirror_hash ^= self.zobrist[mark][self.mirror[bit]]
+        if self.evaluator is not None:
+            self.evaluator.add(bit, mark)
+        self.heights[col] += 1
+        self.history.append((col, mark))
+
+    def undo(self):
+        col, mark = self.history.pop()
+        self.heights[col] -= 1
+        bit = col * self.height + self.heights[col]
+        self.masks[mark] ^= 1 << bit
+        self.hash ^= self.zobrist[mark][bit]
+        self.mirror_hash ^= self.zobrist[mark][self.mirror[bit]]
+        if self.evaluator is not None:
+            self.evaluator.remove(bit, mark)
+
+    def num_moves(self):
+        return sum(self.heights)
+
+    def is_full(self):
+        return (self.masks[1] | self.masks[2]) == self.board_mask
+
+    def is_win(self, mark):
+        return has_line(self.masks[mark], self.directions, self.inarow)
+
+    # True if dropping a piece of mark in col completes a line
+    def is_winning_move(self, col, mark):
+        if self.heights[col] >= self.rows:
+            return False
+        bit = 1 << (col * self.height + self.heights[col])
+        return has_line(self.masks[mark] | bit, self.directions, self.inarow)
+
+    # Same semantics as engine.is_terminal_node: a full board or a line for either player
+    def is_terminal(self):
+        if self.evaluator is not None:
+            return self.evaluator.lines > 0 or self.is_full()
+        return self.is_full() or self.is_win(1) or self.is_win(2)
+
+    # Unique integer for the position: mark 1's pieces plus (all pieces + bottom row), which
+    # sets a marker bit above every column's top piece. Fits in 64 bits on the 6x7 board.
+    def key(self):
+        return self.masks[1] + (self.masks[1] | self.masks[2]) + self.bottom
+
+    # key() of the left-right mirror of the position
+    def mirror_key(self):
+        first = self.mirror_mask(self.masks[1])
+        return first + (first | self.mirror_mask(self.masks[2])) + self.bottom
+
+    # Hash that a position and its mirror share, and whether it is the mirror's hash (stored
+    # moves then have to be mirrored with columns-1-col)
+    def canonical_hash(self):
+        if self.mirror_hash < self.hash:
+            return self.mirror_hash, True
+        return self.hash, False
+
+    # True if the position is its own left-right mirror, so mirrored columns are equivalent
+    def is_symmetric(self):
+        return self.mirror_hash == self.hash and all(self.mirror_mask(mask) == mask for mask in self.masks[1:])
+
+    # Helper for mirror_key: swaps column col with column columns-1-col in a bitboard
+    def mirror_mask(self, mask):
+        return mirror_mask(mask, self.columns, self.height)
+
+    def to_grid(self):
+        grid = np.zeros((self.rows, self.columns), dtype=np.int8)
+        for mark in (1, 2):
+            mask = self.masks[mark]
+            for col in range(self.columns):
+                for row in range(self.heights[col]):
+                    if (mask >> (col * self.height + row)) & 1:
+                        grid[self.rows - 1 - row][col] = mark
+        return grid
+
+    def to_board(self):
+        return self.to_grid().flatten().tolist()
+
+    # Equivalent of engine.count_windows: windows with num_discs pieces of mark and the rest empty
+    def count_windows(self, num_discs, mark):
+        if self.evaluator is not None:
+            counts = self.evaluator.counts[mark]
+            return counts[num_discs] if num_discs < len(counts) else 0
+        own = self.masks[mark]
+        opp = self.masks[mark % 2 + 1]
+        total = 0
+        for window in self.windows:
+            if not window & opp and (window & own).bit_count() == num_discs:
+                total += 1
+        return total
+
+    # Per-player window counts: counts[m][n] = windows with n pieces of mark m and no opponent piece
+    def window_counts(self):
+        if self.evaluator is not None:
+            return {1: list(self.evaluator.counts[1]), 2: list(self.evaluator.counts[2])}
+        size = max(self.inarow, 4) + 1
+        first, second = [0] * size, [0] * size
+        mask1, mask2 = self.masks[1], self.masks[2]
+        for window in self.windows:
+            pieces1 = window & mask1
+            pieces2 = window & mask2
+            if not pieces2:
+                first[pieces1.bit_count()] += 1
+                if not pieces1:
+                    second[0] += 1
+            elif not pieces1:
+                second[pieces2.bit_count()] += 1
+        return {1: first, 2: second}
+
+    # Same scoring as engine.get_heuristic
+    def heuristic(self, mark):
+        if self.evaluator is not None:
+            own, opp = self.evaluator.counts[mark], self.evaluator.counts[mark % 2 + 1]
+        else:
+            counts = self.window_counts()
+            own, opp = counts[mark], counts[mark % 2 + 1]
+        return own[3] - 1e1*opp[2] - 1e2*opp[3] - 1e4*opp[4] + 1e6*own[4]
@@ -0,0 +1,133 @@
+import mmap
+import os
+import struct
+import time
+import types
+
+from bitboard import Position
+from search import Searcher, center_order
+
+
+# File layout: one header, then the records sorted by key.
+# Header: magic, version, rows, columns, inarow, plies covered, search depth, record count
+HEADER = struct.Struct("<4sHBBBBBxI")
+# Record: canonical position key (Position.key() of the smaller mirror), best column for that orientation
+RECORD = struct.Struct("<QB")
+MAGIC = b"C4BK"
+VERSION = 1
+
+
+# Helper function for build_book: one position per mirror pair among the non-terminal positions
+# reachable within plies moves, as a dict {canonical key: position}
+def opening_positions(config, plies):
+    root = Position(config)
+    positions = {min(root.key(), root.mirror_key()): root}
+    frontier = [root]
+    for ply in range(plies):
+        mark = ply % 2 + 1
+        next_frontier = []
+        for position in frontier:
+            for col in position.valid_moves():
+                child = position.copy()
+                child.play(col, mark)
+                canonical = min(child.key(), child.mirror_key())
+                if canonical in positions or child.is_terminal():
+                    continue
+                positions[canonical] = child
+                next_frontier.append(child)
+        frontier = next_frontier
+    return positions
+
+
+def build_book(path, config, plies=4, depth=8, verbose=False):
+    """
+    Searches every opening position up to plies moves deep (mirror positions only once)
+    to depth and writes the best columns to a sorted binary book at path.
+
+    Returns the number of records written.
+    """
+    if config.columns * (config.rows + 1) > 64:
+        raise ValueError("opening book keys need columns * (rows + 1) <= 64 bits")
+    positions = opening_positions(config, plies)
+    records = []
+    start = time.perf_counter()
+    for canonical, position in positions.items():
+        mark = position.num_moves() % 2 + 1
+        scores = Searcher(mark, config).root_scores(position, depth)
+        best = max(scores.values())
+        move = next(col for col in center_order(config.columns) if scores.get(col) == best)
+        if position.key() != canonical:
+            move = config.columns - 1 - move
+        records.append((canonical, move))
+        if verbose and len(records) % 100 == 0:
+            print("%d/%d positions, %.0fs" % (len(records), len(positions), time.perf_counter() - start))
+    records.sort()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, config.rows, config.columns, config.inarow,
+                            plies, depth, len(records)))
+        for record in records:
+            f.write(RECORD.pack(*record))
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+class OpeningBook:
+    """Read-only view of a book file written by build_book.
+
+    The file is memory-mapped and searched with a binary search, so opening it reads
+    only the header and a lookup touches about log2(records) pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.rows, self.columns, self.inarow,
+         self.plies, self.depth, self.count) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s is not a version %d opening book" % (path, VERSION))
+
+    def matches(self, config):
+        return (self.rows, self.columns, self.inarow) == (config.rows, config.columns, config.inarow)
+
+    # Best column for mark in position, or None if the position is not in the book
+    def lookup(self, position, mark):
+        if position.num_moves() > self.plies or position.num_moves() % 2 + 1 != mark:
+            return None
+        key, mirror_key = position.key(), position.mirror_key()
+        canonical = min(key, mirror_key)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, move = RECORD.unpack_from(self.data, HEADER.size + middle * RECORD.size)
+            if record_key < canonical:
+                low = middle + 1
+            elif record_key > canonical:
+                high = middle
+            else:
+                if key != canonical:
+                    move = self.columns - 1 - move
+                return move if position.can_play(move) else None
+        return None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the opening book used by engine.agent")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book.bin"))
+    parser.add_argument("--plies", type=int, default=4, help="book covers positions with up to this many pieces")
+    parser.add_argument("--depth", type=int, default=8, help="search depth for every book position")
+    parser.add_argument("--rows", type=int, default=6)
+    parser.add_argument("--columns", type=int, default=7)
+    parser.add_argument("--inarow", type=int, default=4)
+    args = parser.parse_args()
+    config = types.SimpleNamespace(rows=args.rows, columns=args.columns, inarow=args.inarow)
+    count = build_book(args.out, config, args.plies, args.depth, verbose=True)
+    print("Wrote %d positions to %s" % (count, args.out))
@@ -1,13 +1,16 @@
 import pygame
 import numpy as np
+import os
 import sys
+import queue
+import threading
+import time
+import traceback
 from pygame.locals import *
 
 # Import your existing AI agent and helper functions
-from trainC4 import agent, drop_piece, is_terminal_node, score_move, get_heuristic
-
-# Initialize pygame
-pygame.init()
+from engine import agent, analyse, drop_piece, interrupt, is_terminal_node, score_move, get_heuristic
+from gamerecords import RECORDS_PATH, agent_name, record_game
 
 # Colors
 BLUE = (0, 0, 255)
@@ -25,17 +28,34 @@ COLUMNS = 7
 INAROW = 4
 SQUARESIZE = 100
 RADIUS = int(SQUARESIZE/2 - 5)
-AI_SEARCH_DEPTH = 3  # Depth for minimax search
+AI_SEARCH_DEPTH = 3  # Depth of the player's reward hints; the AI panel shows the AI's own search
+SHOW_SEARCH_STATS = False  # Show the statistics of the AI's search (nodes, depth, time) in the info panel
+FPS = 30  # Frame cap of the main loop
+DROP_STEP_MS = 50  # Time a dropping piece spends in each row
+GAME_RECORDS = RECORDS_PATH  # Store finished games are appended to (None to keep no records)
 
 # Screen dimensions
 width = COLUMNS * SQUARESIZE
 height = (ROWS + 2) * SQUARESIZE  # Extra rows for piece dropping animation and info panel
 size = (width, height)
 
-screen = pygame.display.set_mode(size)
-pygame.display.set_caption('Connect Four')
-game_font = pygame.font.SysFont("Arial", 32)
-info_font = pygame.font.SysFont("Arial", 18)
+# Set up by init_display()
+screen = None
+game_font = None
+info_font = None
+renderer = None
+
+def init_display(headless=False):
+    """Opens the window (or, headless, an offscreen surface on SDL's dummy video driver)"""
+    global screen, game_font, info_font, renderer
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.init()
+    screen = pygame.display.set_mode(size)
+    pygame.display.set_caption('Connect Four')
+    game_font = pygame.font.SysFont("Arial", 32)
+    info_font = pygame.font.SysFont("Arial", 18)
+    renderer = Renderer(screen)
 
 class Config:
     def __init__(self, rows, columns, inarow):
@@ -67,9 +87,10 @@ class Button:
         pygame.draw.rect(screen, BLACK, self.rect, 2, 10)  # Border
         
         # Draw the text
-        text_surface = game_font.render(self.text, True, self.text_color)
+        text_surface = renderer.text(game_font, self.text, self.text_color)
         text_rect = text_surface.get_rect(center=self.rect.center)
         screen.blit(text_surface, text_rect)
+        renderer.invalidate(self.rect)
         
     def is_hover(self, pos):
         if self.rect.collidepoint(pos):
@@ -84,31 +105,152 @@ class Button:
                 return True
         return False
 
+class SearchWorker:
+    """Runs AI moves and reward computations on a background thread.
+
+    Jobs are tagged with the generation they were submitted in. cancel() starts a
+    new generation: queued jobs of older generations are skipped, a running search
+    is interrupted and results of a job that was already running are dropped, so
+    they never reach a new board. A job that raises gives an ("error", exception)
+    result instead of its own.
+    """
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, func, *args):
+        self.jobs.put((self.generation, kind, func, args))
+
+    def cancel(self):
+        self.generation += 1
+        interrupt()
+
+    def run(self):
+        while True:
+            generation, kind, func, args = self.jobs.get()
+            if generation == self.generation:
+                try:
+                    result = func(*args)
+                except Exception as error:
+                    kind, result = "error", error
+                self.results.put((generation, kind, result))
+
+    def poll(self):
+        """Returns the (kind, result) pairs finished since the last call for the current generation"""
+        finished = []
+        while True:
+            try:
+                generation, kind, result = self.results.get_nowait()
+            except queue.Empty:
+                return finished
+            if generation == self.generation:
+                finished.append((kind, result))
+
+class Renderer:
+    """Draws the game into screen and sends only the changed parts to the display.
+
+    Board cells and pieces are rendered once and blitted from surfaces, text is
+    rendered once per (font, string, color), and the top row and info panel are only
+    redrawn when what they show changes. Every draw records its rect; flush() updates
+    just those rects, once per frame.
+    """
+    def __init__(self, screen):
+        self.screen = screen
+        self.dirty = []
+        self.glyphs = {}
+        self.top_state = None
+        self.panel_state = None
+        # One board cell per piece (0 = empty): a blue square with a hole or a piece in it
+        self.cells = {}
+        for piece, color in ((0, BLACK), (1, RED), (2, YELLOW)):
+            cell = pygame.Surface((SQUARESIZE, SQUARESIZE))
+            cell.fill(BLUE)
+            pygame.draw.circle(cell, color, (SQUARESIZE//2, SQUARESIZE//2), RADIUS)
+            self.cells[piece] = cell
+
+    def text(self, font, string, color):
+        key = (id(font), string, color)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            if len(self.glyphs) > 1024:
+                self.glyphs.clear()
+            glyph = self.glyphs[key] = font.render(string, True, color)
+        return glyph
+
+    def invalidate(self, rect):
+        self.dirty.append(pygame.Rect(rect))
+
+    def draw_cell(self, row, col, piece):
+        rect = self.screen.blit(self.cells[piece], (col*SQUARESIZE, (row+1)*SQUARESIZE))
+        self.dirty.append(rect)
+
+    def draw_board(self, board):
+        for c in range(COLUMNS):
+            for r in range(ROWS):
+                self.screen.blit(self.cells[int(board[r][c])], (c*SQUARESIZE, (r+1)*SQUARESIZE))
+        self.invalidate((0, SQUARESIZE, width, ROWS * SQUARESIZE))
+
+    def draw_top(self, state):
+        """Redraws the top row for state, a tuple naming what it shows:
+        ("piece", x), ("thinking", dots), ("message", text, color, button, button color) or ("empty",)"""
+        if state == self.top_state:
+            return
+        self.top_state = state
+        pygame.draw.rect(self.screen, BLACK, (0, 0, width, SQUARESIZE))
+        if state[0] == "piece":
+            pygame.draw.circle(self.screen, RED, (state[1], int(SQUARESIZE/2)), RADIUS)
+        elif state[0] == "thinking":
+            thinking_text = self.text(game_font, "AI is thinking" + state[1], YELLOW)
+            self.screen.blit(thinking_text, thinking_text.get_rect(midleft=(width/2 - 110, SQUARESIZE/2)))
+        elif state[0] == "message":
+            label = self.text(game_font, state[1], state[2])
+            self.screen.blit(label, label.get_rect(center=(width/2, SQUARESIZE/2)))
+            if state[3] is not None:
+                state[3].draw()
+        self.invalidate((0, 0, width, SQUARESIZE))
+
+    def draw_panel(self, rewards, total_reward, active_col=None, stats=None):
+        state = (tuple(rewards.items()), total_reward, active_col, None if stats is None else tuple(stats.items()))
+        if state == self.panel_state:
+            return
+        self.panel_state = state
+        top = (ROWS+1)*SQUARESIZE
+        pygame.draw.rect(self.screen, BLACK, (0, top, width, SQUARESIZE))
+        
+        # Draw total reward
+        self.screen.blit(self.text(info_font, f"Total Reward: {total_reward:.2f}", WHITE), (10, top + 10))
+        
+        # Draw rewards for each column, highlighting the active column
+        for col, reward in rewards.items():
+            color = GREEN if col == active_col else WHITE
+            text = self.text(info_font, f"{reward:.2f}", color)
+            self.screen.blit(text, text.get_rect(center=(col*SQUARESIZE + SQUARESIZE/2, top + 50)))
+            col_text = self.text(info_font, f"Col {col}", LIGHT_BLUE)
+            self.screen.blit(col_text, col_text.get_rect(center=(col*SQUARESIZE + SQUARESIZE/2, top + 30)))
+        
+        # Draw the search statistics
+        if stats is not None:
+            stats_text = info_font.render(
+                f"{stats['search']} d{stats['depth']} | {stats['nodes']} nodes | {stats['wall_time']*1000:.0f} ms | "
+                f"cache {stats['tt_hits']}/{stats['tt_probes']} | eval {stats['heuristic_time']*1000:.0f} ms | "
+                f"movegen {stats['movegen_time']*1000:.0f} ms", True, GRAY)
+            self.screen.blit(stats_text, (10, top + 70))
+        self.invalidate((0, top, width, SQUARESIZE))
+
+    def flush(self):
+        if self.dirty:
+            pygame.display.update(self.dirty)
+            self.dirty = []
+
 def create_board():
     board = np.zeros((ROWS, COLUMNS))
     return board
 
 def draw_board(board):
-    # Clear the board area
-    pygame.draw.rect(screen, BLACK, (0, SQUARESIZE, width, ROWS * SQUARESIZE))
-    
-    # Draw the blue board background
-    for c in range(COLUMNS):
-        for r in range(ROWS):
-            pygame.draw.rect(screen, BLUE, (c*SQUARESIZE, r*SQUARESIZE+SQUARESIZE, SQUARESIZE, SQUARESIZE))
-            # Create empty circles for places where pieces can go
-            pygame.draw.circle(screen, BLACK, (int(c*SQUARESIZE+SQUARESIZE/2), int(r*SQUARESIZE+SQUARESIZE+SQUARESIZE/2)), RADIUS)
-    
-    # Draw the pieces - placing them at the bottom of the board
-    for c in range(COLUMNS):
-        for r in range(ROWS):
-            if board[r][c] == 1:  # Player 1 (RED)
-                pygame.draw.circle(screen, RED, (int(c*SQUARESIZE+SQUARESIZE/2), 
-                                             int((r+1)*SQUARESIZE+SQUARESIZE/2)), RADIUS)
-            elif board[r][c] == 2:  # Player 2 / AI (YELLOW)
-                pygame.draw.circle(screen, YELLOW, (int(c*SQUARESIZE+SQUARESIZE/2), 
-                                               int((r+1)*SQUARESIZE+SQUARESIZE/2)), RADIUS)
-    pygame.display.update()
+    renderer.draw_board(board)
 
 def is_valid_location(board, col):
     # Check if the top row of the column is empty
@@ -121,31 +263,13 @@ def get_next_open_row(board, col):
             return r
     return -1  # Column is full
 
-def animate_dropping_piece(board, row, col, piece):
-    """Animate the piece dropping to its position"""
-    color = RED if piece == 1 else YELLOW
-    
-    # Clear the top area where the moving piece is shown
-    pygame.draw.rect(screen, BLACK, (0, 0, width, SQUARESIZE))
-    
-    # Start animation from top of the board
-    for r in range(0, row + 1):
-        # Clear previous position and redraw the blue board with black circle
-        if r > 0:
-            # Redraw the blue background at the previous position
-            pygame.draw.rect(screen, BLUE, (col*SQUARESIZE, (r-1)*SQUARESIZE+SQUARESIZE, SQUARESIZE, SQUARESIZE))
-            # Redraw the empty circle
-            pygame.draw.circle(screen, BLACK, (int(col*SQUARESIZE+SQUARESIZE/2), 
-                                           int((r-1)*SQUARESIZE+SQUARESIZE+SQUARESIZE/2)), RADIUS)
-        
-        # Draw piece at current position
-        pygame.draw.circle(screen, color, (int(col*SQUARESIZE+SQUARESIZE/2), 
-                                       int(r*SQUARESIZE+SQUARESIZE+SQUARESIZE/2)), RADIUS)
-        pygame.display.update()
-        pygame.time.wait(50)  # Animation speed
-    
-    # Finally update the actual board data
-    board[row][col] = piece
+def draw_dropping_piece(col, row, piece, elapsed):
+    """Draws the piece dropping towards row (one row per DROP_STEP_MS); True once it has landed"""
+    r = min(row, elapsed // DROP_STEP_MS)
+    for above in range(r):
+        renderer.draw_cell(above, col, 0)
+    renderer.draw_cell(r, col, piece)
+    return elapsed >= (row + 1) * DROP_STEP_MS
 
 def check_win(board, piece):
     # Check horizontal
@@ -174,55 +298,42 @@ def check_win(board, piece):
                 
     return False
 
-def draw_text(text, color, y_position=SQUARESIZE/2):
-    # Draw text on top of the screen
-    label = game_font.render(text, True, color)
-    text_rect = label.get_rect(center=(width/2, y_position))
-    screen.blit(label, text_rect)
-    pygame.display.update()
+def draw_text(text, color, button=None):
+    """Shows text (and the button, if given) in the top row"""
+    renderer.draw_top(("message", text, color, button, button and button.current_color))
 
-def calculate_rewards(board, mark, config):
+def calculate_rewards(board, mark, config, nsteps=AI_SEARCH_DEPTH):
     """Calculate rewards for each possible move"""
-    rewards = {}
-    valid_moves = [c for c in range(config.columns) if board[0][c] == 0]
-    
-    # Convert numpy array to what score_move expects
-    grid = board.copy()
-    
-    total_reward = 0
-    for col in valid_moves:
-        # Use your existing score_move function to calculate the reward
-        reward = score_move(grid, col, mark, config, AI_SEARCH_DEPTH)
-        rewards[col] = reward
-        total_reward += reward
-    
+    return search_rewards(analyse(board, mark, config, nsteps))
+
+def search_rewards(result):
+    """Rewards and total reward shown in the info panel for an engine.analyse result"""
+    rewards = dict(result.scores)
+    total_reward = sum(rewards.values())
     return rewards, total_reward
 
-def display_rewards(rewards, total_reward, active_col=None):
-    """Display the rewards for each column and the total reward"""
-    # Clear the info panel area
-    pygame.draw.rect(screen, BLACK, (0, (ROWS+1)*SQUARESIZE, width, SQUARESIZE))
-    
-    # Draw total reward
-    total_text = info_font.render(f"Total Reward: {total_reward:.2f}", True, WHITE)
-    screen.blit(total_text, (10, (ROWS+1)*SQUARESIZE + 10))
-    
-    # Draw rewards for each column
-    for col, reward in rewards.items():
-        # Highlight active column if specified
-        color = GREEN if col == active_col else WHITE
-        text = info_font.render(f"{reward:.2f}", True, color)
-        text_rect = text.get_rect(center=(col*SQUARESIZE + SQUARESIZE/2, (ROWS+1)*SQUARESIZE + 50))
-        screen.blit(text, text_rect)
-        
-        # Draw column indicators
-        col_text = info_font.render(f"Col {col}", True, LIGHT_BLUE)
-        col_rect = col_text.get_rect(center=(col*SQUARESIZE + SQUARESIZE/2, (ROWS+1)*SQUARESIZE + 30))
-        screen.blit(col_text, col_rect)
-    
-    pygame.display.update()
+def display_rewards(rewards, total_reward, active_col=None, stats=None):
+    """Display the rewards for each column and the total reward (and a search statistics record if given)"""
+    renderer.draw_panel(rewards, total_reward, active_col, stats)
+
+def draw_thinking():
+    """Animated "AI is thinking" indicator in the top row (redrawn only when the dots change)"""
+    renderer.draw_top(("thinking", "." * (pygame.time.get_ticks() // 300 % 4)))
+
+def ai_search(flat_board, config):
+    """Background job: the AI's search, giving both its column and the rewards shown for it"""
+    return analyse(flat_board, 2, config, stats=SHOW_SEARCH_STATS)
 
-def play_game():
+def play_game(max_frames=None, script=None, record_path=GAME_RECORDS):
+    """Runs the game loop at up to FPS frames per second.
+
+    For measurements, script(frame) can return events to post before each frame, and
+    the loop returns the list of frame times (seconds of work per frame) after
+    max_frames frames instead of running until the window is closed. Finished games are
+    appended to the game record store at record_path (None to keep no records).
+    """
+    if screen is None:
+        init_display()
     board = create_board()
     game_over = False
     turn = 0  # 0 for Player 1, 1 for AI
@@ -230,140 +341,190 @@ def play_game():
     # Create Play Again button (initially hidden)
     play_again_btn = Button("Play Again", width//2 - 100, SQUARESIZE//2 - 25, 200, 50, GREEN, LIGHT_BLUE)
     show_play_again = False
+    message = None  # (text, color) shown in the top row when the game is over
     
-    # Initialize rewards
+    # AI search and reward computation run on this worker; the loop only polls it
+    worker = SearchWorker()
     config = Config(ROWS, COLUMNS, INAROW)
-    player_rewards, player_total = calculate_rewards(board, 1, config)
-    ai_rewards, ai_total = calculate_rewards(board, 2, config)
+    player_rewards, player_total = {}, 0
+    ai_rewards, ai_total = {}, 0
+    ai_stats = None  # statistics record of the AI's last search, if SHOW_SEARCH_STATS
+    ai_col = None  # AI's chosen column once its search has finished
+    ai_move_at = None  # time at which the chosen column is played, after highlighting its reward
+    drop = None  # (col, row, piece, start time) of the piece being animated
+    hover_x = None  # x of the player's piece above the board
+    moves, move_times = [], []  # columns played and seconds each side took, for the game record
+    move_start = time.perf_counter()
+    
+    # Initialize rewards
+    worker.submit("player_rewards", calculate_rewards, board.copy(), 1, config)
     
     # Clear screen and draw initial board
     screen.fill(BLACK)
+    pygame.display.update()
     draw_board(board)
     display_rewards(player_rewards, player_total)
     
-    while True:  # Main game loop
+    clock = pygame.time.Clock()
+    frame_times = []
+    while max_frames is None or len(frame_times) < max_frames:  # Main game loop
+        if script is not None:
+            for event in script(len(frame_times)):
+                pygame.event.post(event)
+        frame_start = time.perf_counter()
+        
+        # Apply background results that completed since the last frame
+        for kind, result in worker.poll():
+            if kind == "player_rewards":
+                player_rewards, player_total = result
+                if turn == 0:
+                    display_rewards(player_rewards, player_total)
+            elif kind == "ai_search":
+                ai_rewards, ai_total = search_rewards(result)
+                ai_stats = result.stats
+                ai_col = result.move
+            elif kind == "error":
+                # The search failed (e.g. EVALUATOR = "learned" without a model file): end the game with the error
+                traceback.print_exception(result)
+                message = ("AI error: " + type(result).__name__, RED)
+                game_over = True
+                show_play_again = True
+        
         # Handle events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
             
-            mouse_pos = pygame.mouse.get_pos()
+            mouse_pos = getattr(event, "pos", None) or pygame.mouse.get_pos()
             
             # Handle Play Again button if game is over
             if show_play_again:
                 play_again_btn.is_hover(mouse_pos)
-                play_again_btn.draw()
                 
                 if event.type == pygame.MOUSEBUTTONDOWN and play_again_btn.is_clicked(mouse_pos, event):
-                    # Reset the game
+                    # Drop whatever the worker was computing for the old board and reset the game
+                    worker.cancel()
                     board = create_board()
                     game_over = False
                     turn = 0
                     show_play_again = False
-                    player_rewards, player_total = calculate_rewards(board, 1, config)
+                    message = None
+                    ai_col, ai_move_at = None, None
+                    moves, move_times = [], []
+                    move_start = time.perf_counter()
+                    player_rewards, player_total = {}, 0
+                    worker.submit("player_rewards", calculate_rewards, board.copy(), 1, config)
                     
-                    # Clear screen and redraw
-                    screen.fill(BLACK)
+                    # Redraw the board and panel
                     draw_board(board)
                     display_rewards(player_rewards, player_total)
-                    pygame.display.update()
                     continue
             
-            # Handle game play if game is not over
-            if not game_over:
-                if event.type == pygame.MOUSEMOTION:
-                    # Clear the top row (where we show the moving piece)
-                    pygame.draw.rect(screen, BLACK, (0, 0, width, SQUARESIZE))
+            # Handle game play if game is not over and no piece is falling
+            if not game_over and drop is None:
+                if event.type == pygame.MOUSEMOTION and turn == 0:
                     # Draw the moving piece in the top row
                     posx = event.pos[0]
                     col = int(posx // SQUARESIZE)
+                    hover_x = posx if 0 <= col < COLUMNS else None
                     
-                    if turn == 0 and 0 <= col < COLUMNS:
-                        pygame.draw.circle(screen, RED, (posx, int(SQUARESIZE/2)), RADIUS)
-                        
-                        # Highlight the active column's reward
-                        if col in player_rewards:
-                            display_rewards(player_rewards, player_total, col)
-                    
-                    pygame.display.update()
+                    # Highlight the active column's reward
+                    if col in player_rewards:
+                        display_rewards(player_rewards, player_total, col)
                     
                 if event.type == pygame.MOUSEBUTTONDOWN and turn == 0:
-                    # Player 1's turn
-                    # Clear the top row
-                    pygame.draw.rect(screen, BLACK, (0, 0, width, SQUARESIZE))
-                    
-                    # Get column from mouse position
+                    # Player 1's turn: get column from mouse position
                     posx = event.pos[0]
                     col = int(posx // SQUARESIZE)
                     
                     if 0 <= col < COLUMNS and is_valid_location(board, col):
-                        row = get_next_open_row(board, col)
-                        animate_dropping_piece(board, row, col, 1)
-                        
-                        # Update and display rewards after player's move
-                        ai_rewards, ai_total = calculate_rewards(board, 2, config)
-                        display_rewards(ai_rewards, ai_total)
-                        
-                        if check_win(board, 1):
-                            draw_text("Player 1 wins!", RED)
-                            game_over = True
-                            show_play_again = True
-                        elif not any(is_valid_location(board, c) for c in range(COLUMNS)):
-                            draw_text("It's a draw!", WHITE)
-                            game_over = True
-                            show_play_again = True
-                        else:
-                            turn = 1  # Switch to AI turn
+                        drop = (col, get_next_open_row(board, col), 1, pygame.time.get_ticks())
+                        move_times.append(time.perf_counter() - move_start)
+                        hover_x = None
         
         # AI's turn
-        if turn == 1 and not game_over:
-            # Clear the top row
-            pygame.draw.rect(screen, BLACK, (0, 0, width, SQUARESIZE))
-            
-            # Show "AI is thinking" text
-            thinking_text = game_font.render("AI is thinking...", True, YELLOW)
-            text_rect = thinking_text.get_rect(center=(width/2, SQUARESIZE/2))
-            screen.blit(thinking_text, text_rect)
-            pygame.display.update()
-            
-            # Prepare the observation for the AI
-            flat_board = board.flatten().tolist()
-            obs = SimpleObs(flat_board, 2)
-            config = Config(ROWS, COLUMNS, INAROW)
-            
-            # Get AI's move
-            col = agent(obs, config)
-            
-            # Highlight AI's chosen column reward
-            display_rewards(ai_rewards, ai_total, col)
-            pygame.time.wait(500)  # Pause to show the highlighted reward
-            
-            if is_valid_location(board, col):
-                row = get_next_open_row(board, col)
-                animate_dropping_piece(board, row, col, 2)
-                
-                # Update and display rewards after AI's move
-                player_rewards, player_total = calculate_rewards(board, 1, config)
-                display_rewards(player_rewards, player_total)
-                
-                if check_win(board, 2):
-                    draw_text("AI wins!", YELLOW)
+        if turn == 1 and not game_over and drop is None:
+            if ai_col is not None and ai_move_at is None:
+                # Highlight AI's chosen column reward for a moment before playing it
+                display_rewards(ai_rewards, ai_total, ai_col, ai_stats)
+                ai_move_at = pygame.time.get_ticks() + 500
+            elif ai_col is not None and pygame.time.get_ticks() >= ai_move_at:
+                col, ai_col, ai_move_at = ai_col, None, None
+                if is_valid_location(board, col):
+                    drop = (col, get_next_open_row(board, col), 2, pygame.time.get_ticks())
+                    move_times.append(time.perf_counter() - move_start)
+        
+        # Animate the falling piece; once it lands, the move is made
+        if drop is not None:
+            col, row, piece, start = drop
+            if draw_dropping_piece(col, row, piece, pygame.time.get_ticks() - start):
+                drop = None
+                board[row][col] = piece
+                moves.append(col)
+                move_start = time.perf_counter()
+                if check_win(board, piece):
+                    message = ("Player 1 wins!", RED) if piece == 1 else ("AI wins!", YELLOW)
                     game_over = True
                     show_play_again = True
+                    record_game(moves, piece, ("human", agent_name(agent)), config, move_times, record_path)
                 elif not any(is_valid_location(board, c) for c in range(COLUMNS)):
-                    draw_text("It's a draw!", WHITE)
+                    message = ("It's a draw!", WHITE)
                     game_over = True
                     show_play_again = True
+                    record_game(moves, 0, ("human", agent_name(agent)), config, move_times, record_path)
+                elif piece == 1:
+                    # Switch to AI turn: one background search gives its move and rewards
+                    turn = 1
+                    ai_col, ai_move_at = None, None
+                    worker.submit("ai_search", ai_search, board.flatten().tolist(), config)
                 else:
                     turn = 0  # Switch to Player 1 turn
+                    # Update rewards after AI's move in the background
+                    worker.submit("player_rewards", calculate_rewards, board.copy(), 1, config)
         
-        # Draw Play Again button if game is over
-        if show_play_again:
-            play_again_btn.draw()
-            
-        pygame.display.update()
-        pygame.time.wait(50)  # Small delay to prevent CPU hogging
+        # Top row: result and Play Again button, AI thinking, or the player's piece
+        if message is not None:
+            draw_text(message[0], message[1], play_again_btn if show_play_again else None)
+        elif turn == 1 and ai_col is None and drop is None:
+            draw_thinking()
+        elif turn == 0 and hover_x is not None and drop is None:
+            renderer.draw_top(("piece", hover_x))
+        else:
+            renderer.draw_top(("empty",))
+        
+        renderer.flush()
+        frame_times.append(time.perf_counter() - frame_start)
+        clock.tick(FPS)
+    worker.cancel()
+    return frame_times
+
+def measure_frame_times(frames=600, click_every=20):
+    """Plays scripted moves on the dummy video driver and reports the work time per frame"""
+    init_display(headless=True)
+    moves = [3, 3, 2, 4, 1, 5, 0, 6, 3, 2, 2, 4, 5, 1, 0, 6]
+
+    def script(frame):
+        x = (frame * 37) % width
+        events = [pygame.event.Event(pygame.MOUSEMOTION, pos=(x, 50), rel=(0, 0), buttons=(0, 0, 0))]
+        if frame % click_every == click_every - 1:
+            col = moves[frame // click_every % len(moves)]
+            events.append(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(col*SQUARESIZE + 50, 50), button=1))
+        return events
+
+    times = sorted(play_game(frames, script, record_path=None))
+    return {
+        "frames": len(times),
+        "median_ms": times[len(times)//2] * 1000,
+        "p95_ms": times[int(len(times)*0.95)] * 1000,
+        "p99_ms": times[int(len(times)*0.99)] * 1000,
+        "max_ms": times[-1] * 1000,
+    }
             
 if __name__ == "__main__":
-    play_game()
+    if "--headless" in sys.argv:
+        # Frame-time measurement: python connect4.py --headless [frames]
+        args = sys.argv[sys.argv.index("--headless")+1:]
+        print(measure_frame_times(int(args[0]) if args else 600))
+    else:
+        play_game()
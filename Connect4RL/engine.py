@@ -0,0 +1,475 @@
+import collections
+import functools
+import os
+import numpy as np
+import random
+import time
+
+from bitboard import Position
+from book import OpeningBook
+from search import Searcher, mirror_reduced, mirror_scores
+from solver import Solver
+from stats import SearchStats, TimedSearcher, log_stats
+from threats import ThreatAnalyzer
+from transposition import TranspositionTable
+
+
+# helper function for score move - gets board at next step if agent drops piece in selected column
+def drop_piece(grid, col, mark, config):
+    next_grid = grid.copy()
+    for row in range(config.rows - 1, -1, -1):
+        if next_grid[row][col] == 0:
+            break
+    next_grid[row][col] = mark
+    return next_grid
+
+
+# # Helper fnction for score move - gets heuristic score of the grid
+# def get_heuristic(grid, mark, config):
+#     num_threes = count_windows(grid, mark, 3, config)
+#     num_fours = count_windows(grid, 4, mark, config)
+#     num_threes_opp = count_windows(grid, 3, mark%2+1, config)
+#     score = num_threes - 1e2*num_threes_opp + 1e6*num_fours
+#     return score
+
+
+# Helper function for minimax: calculates value of heuristic for grid
+def get_heuristic(grid, mark, config):
+    counts = window_counts(grid, mark, config)
+    num_threes = counts[3, 0]
+    num_fours = counts[4, 0]
+    num_twos_opp = counts[0, 2]
+    num_threes_opp = counts[0, 3]
+    num_fours_opp = counts[0, 4]
+    score = num_threes - 1e1*num_twos_opp - 1e2*num_threes_opp - 1e4*num_fours_opp + 1e6*num_fours
+    return score
+
+
+# Scores and terminal flags for a stack of boards of shape (N, rows, columns) in one vectorized
+# call: scores[i] == get_heuristic(boards[i], mark, config), terminal[i] == is_terminal_node(boards[i], config)
+# mark can also be an array with one mark per board
+def evaluate_batch(boards, mark, config):
+    boards = np.asarray(boards)
+    count = boards.shape[0]
+    windows = boards.reshape(count, -1)[:, window_table(config)]
+    mark = np.reshape(mark, (-1, 1, 1))
+    own = np.count_nonzero(windows == mark, axis=2)
+    opp = np.count_nonzero(windows == mark%2+1, axis=2)
+    size = max(config.inarow, 4) + 1
+    codes = own * size + opp + (np.arange(count) * size * size)[:, None]
+    counts = np.bincount(codes.ravel(), minlength=count * size * size).reshape(count, size, size)
+    scores = counts[:, 3, 0] - 1e1*counts[:, 0, 2] - 1e2*counts[:, 0, 3] - 1e4*counts[:, 0, 4] + 1e6*counts[:, 4, 0]
+    terminal = ((own == config.inarow).any(axis=1) | (opp == config.inarow).any(axis=1)
+                | (boards[:, 0, :] != 0).all(axis=1))
+    return scores, terminal
+
+
+# Uses minimax to calculate value of dropping piece in selected column
+# (grid can be a 2D board or a bitboard Position, which is left unchanged)
+# search is "minimax", "batched" or "alphabeta"; all give the same score, None means SEARCH
+# evaluate (an evaluate_batch replacement, e.g. learned.ValueModel.evaluate_batch) scores the
+# leaves instead of the heuristic; the tree is then searched in frontier arrays
+def score_move(grid, col, mark, config, nsteps, search=None, evaluate=None):
+    position = grid if isinstance(grid, Position) else Position.from_grid(grid, config, incremental=True)
+    search = search or SEARCH
+    if search == "alphabeta" and evaluate is None:
+        return Searcher(mark, config).score_move(position, col, nsteps)
+    position.play(col, mark)
+    if evaluate is not None:
+        score = frontier_minimax(position.to_grid(), nsteps-1, False, mark, config, evaluate)
+    else:
+        score = position_minimax(position, nsteps-1, False, mark, BATCH_PLIES if search == "batched" else 0)
+    position.undo()
+    return score
+
+
+# Helper function for minimax: checks if agent or opponent has four in a row in the window
+def is_terminal_window(window, config):
+    return window.count(1) == config.inarow or window.count(2) == config.inarow
+
+
+# Helper function for minimax: checks if game has ended
+def is_terminal_node(grid, config):
+    # Check for draw 
+    if list(grid[0, :]).count(0) == 0:
+        return True
+    # Check for win: horizontal, vertical, or diagonal
+    # horizontal 
+    for row in range(config.rows):
+        for col in range(config.columns-(config.inarow-1)):
+            window = list(grid[row, col:col+config.inarow])
+            if is_terminal_window(window, config):
+                return True
+    # vertical
+    for row in range(config.rows-(config.inarow-1)):
+        for col in range(config.columns):
+            window = list(grid[row:row+config.inarow, col])
+            if is_terminal_window(window, config):
+                return True
+    # positive diagonala
+    for row in range(config.rows-(config.inarow-1)):
+        for col in range(config.columns-(config.inarow-1)):
+            window = list(grid[range(row, row+config.inarow), range(col, col+config.inarow)])
+            if is_terminal_window(window, config):
+                return True
+    # negative diagonal
+    for row in range(config.inarow-1, config.rows):
+        for col in range(config.columns-(config.inarow-1)):
+            window = list(grid[range(row, row-config.inarow, -1), range(col, col+config.inarow)])
+            if is_terminal_window(window, config):
+                return True
+    return False
+
+
+# Minimax implementation (node can be a 2D board or a bitboard Position)
+# The last batch_plies plies are expanded into frontier arrays and scored in bulk; with
+# evaluate (an evaluate_batch replacement) the whole tree is, and its leaves are scored by it
+def minimax(node, depth, maximizingPlayer, mark, config, batch_plies=0, evaluate=None):
+    if evaluate is not None:
+        grid = node.to_grid() if isinstance(node, Position) else node
+        return frontier_minimax(grid, depth, maximizingPlayer, mark, config, evaluate)
+    if not isinstance(node, Position):
+        node = Position.from_grid(node, config, incremental=True)
+    return position_minimax(node, depth, maximizingPlayer, mark, batch_plies)
+
+
+# Helper function for minimax: searches the bitboard in place, undoing every move it makes
+def position_minimax(position, depth, maximizingPlayer, mark, batch_plies=0):
+    if depth == 0 or position.is_terminal():
+        return position.heuristic(mark)
+    if depth <= batch_plies:
+        return frontier_minimax(position.to_grid(), depth, maximizingPlayer, mark, position.config)
+    if maximizingPlayer:
+        value = -np.inf
+        for col in position.valid_moves():
+            position.play(col, mark)
+            value = max(value, position_minimax(position, depth-1, False, mark, batch_plies))
+            position.undo()
+        return value
+    else:
+        value = np.inf
+        for col in position.valid_moves():
+            position.play(col, mark%2+1)
+            value = min(value, position_minimax(position, depth-1, True, mark, batch_plies))
+            position.undo()
+        return value
+
+
+# Helper function for minimax: expands every node of the last depth plies below grid level by
+# level into (N, rows, columns) frontier arrays, scores each level with evaluate_batch and backs
+# the values up with vectorized max/min
+def frontier_minimax(grid, depth, maximizingPlayer, mark, config, evaluate=None):
+    grids = np.asarray(grid, dtype=np.int8)[None]
+    return float(frontier_values(grids, np.array([mark]), depth, maximizingPlayer, config, evaluate)[0])
+
+
+# Helper function for frontier_minimax: minimax values of a stack of root boards searched together,
+# root i for marks[i]. The trees of all roots share one frontier array per ply, so boards from
+# different games are scored in the same evaluate_batch call (or evaluate, if given).
+def frontier_values(grids, marks, depth, maximizingPlayer, config, evaluate=None):
+    evaluate = evaluate or evaluate_batch
+    boards = np.asarray(grids, dtype=np.int8)
+    marks = np.asarray(marks)
+    parents = np.zeros(len(boards), dtype=np.intp)
+    levels = []
+    for ply in range(depth + 1):
+        scores, terminal = evaluate(boards, marks, config)
+        levels.append((scores, terminal, parents))
+        if ply == depth or terminal.all():
+            break
+        players = marks if maximizingPlayer == (ply % 2 == 0) else marks%2+1
+        parents, cols = np.nonzero((boards[:, 0, :] == 0) & ~terminal[:, None])
+        # the piece lands on the lowest empty row: number of empty cells in the column minus one
+        drop_rows = np.count_nonzero(boards[parents, :, cols] == 0, axis=1) - 1
+        boards = boards[parents]
+        boards[np.arange(len(parents)), drop_rows, cols] = players[parents]
+        marks = marks[parents]
+    values = levels[-1][0]
+    for ply in range(len(levels) - 2, -1, -1):
+        scores, terminal, _ = levels[ply]
+        if maximizingPlayer == (ply % 2 == 0):
+            backed = np.full(len(scores), -np.inf)
+            np.maximum.at(backed, levels[ply+1][2], values)
+        else:
+            backed = np.full(len(scores), np.inf)
+            np.minimum.at(backed, levels[ply+1][2], values)
+        values = np.where(terminal, scores, backed)
+    return values
+
+
+# Scores of every valid column for many (grid, mark) positions at once, the same values as
+# score_move at depth nsteps: all root moves of all positions are searched by frontier_values
+# together, so the leaves of different games are evaluated in shared batches. On symmetric
+# grids the right-hand column of each mirror pair copies the score of its twin.
+def batch_move_scores(grids, marks, config, nsteps, evaluate=None):
+    grids = np.asarray(grids, dtype=np.int8).reshape(-1, config.rows, config.columns)
+    symmetric = (grids == grids[:, :, ::-1]).all(axis=(1, 2))
+    owners, cols = np.nonzero((grids[:, 0, :] == 0) & ~(symmetric[:, None] & (2*np.arange(config.columns) > config.columns-1)))
+    drop_rows = np.count_nonzero(grids[owners, :, cols] == 0, axis=1) - 1
+    children = grids[owners]
+    children[np.arange(len(owners)), drop_rows, cols] = np.asarray(marks)[owners]
+    values = frontier_values(children, np.asarray(marks)[owners], nsteps-1, False, config, evaluate)
+    scores = [{} for _ in range(len(grids))]
+    for owner, col, value in zip(owners.tolist(), cols.tolist(), values.tolist()):
+        scores[owner][col] = value
+        if symmetric[owner]:
+            scores[owner][config.columns-1-col] = value
+    return [dict(sorted(owner_scores.items())) for owner_scores in scores]
+
+
+# Helper function for get_heuristic: flat grid indices of every window, shape (windows, inarow)
+# in the order horizontal, vertical, positive diagonal, negative diagonal
+@functools.lru_cache(maxsize=None)
+def window_index_table(rows, columns, inarow):
+    index = np.arange(rows * columns).reshape(rows, columns)
+    windows = []
+    for row in range(rows):
+        for col in range(columns-(inarow-1)):
+            windows.append(index[row, col:col+inarow])
+    for row in range(rows-(inarow-1)):
+        for col in range(columns):
+            windows.append(index[row:row+inarow, col])
+    for row in range(rows-(inarow-1)):
+        for col in range(columns-(inarow-1)):
+            windows.append(index[range(row, row+inarow), range(col, col+inarow)])
+    for row in range(inarow-1, rows):
+        for col in range(columns-(inarow-1)):
+            windows.append(index[range(row, row-inarow, -1), range(col, col+inarow)])
+    table = np.array(windows, dtype=np.intp).reshape(-1, inarow)
+    table.flags.writeable = False
+    return table
+
+
+# Helper function for get_heuristic: window table for a config (computed once per board size)
+def window_table(config):
+    return window_index_table(config.rows, config.columns, config.inarow)
+
+
+# Helper function for get_heuristic: counts[n, m] = number of windows with n pieces of mark
+# and m pieces of the opponent, computed for the whole grid in one gather and one bincount
+def window_counts(grid, mark, config):
+    windows = np.asarray(grid).ravel()[window_table(config)]
+    own = np.count_nonzero(windows == mark, axis=1)
+    opp = np.count_nonzero(windows == mark%2+1, axis=1)
+    size = max(config.inarow, 4) + 1
+    return np.bincount(own * size + opp, minlength=size * size).reshape(size, size)
+
+
+# Helper function for get_heuristic: counts number of windows satisfying specified heuristic conditions
+# (num_discs pieces of piece, the rest of the window empty)
+def count_windows(grid, num_discs, piece, config):
+    if num_discs > config.inarow:
+        return 0
+    return int(window_counts(grid, piece, config)[num_discs, 0])
+
+
+N_STEPS = 4   # Number of steps for minimax search
+SEARCH = "alphabeta"   # "minimax" (full tree), "batched" (full tree, bulk-scored frontier) or "alphabeta" (pruned tree)
+BATCH_PLIES = 3   # Plies at the bottom of the "batched" search that are expanded and scored in bulk
+TIME_BUDGET = None   # Seconds per move; when set, agent deepens iteratively instead of using N_STEPS
+TT_MEGABYTES = 16   # Memory cap of the transposition table kept between agent calls
+TT_POLICY = "depth"   # Replacement policy: "depth" (depth-preferred) or "lru"
+WORKERS = 1   # Processes for the root-parallel search of agent; 1 searches serially
+THREATS = True   # Play forced wins and blocks without searching; the alpha-beta search prunes and extends along threats
+THREAT_EXTENSION = 4   # Most plies the search follows a forcing line past its depth
+ENDGAME_EMPTY = 16   # With this many empty cells or fewer, analyse solves the position exactly
+SEARCH_STATS = False   # Collect search statistics on every analyse call (SearchResult.stats)
+STATS_LOG = None   # Path of a JSONL file that gets one statistics record per search; None disables logging
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book.bin")   # built by book.py; None disables it
+EVALUATOR = "heuristic"   # Leaf scores of the search: "heuristic" (get_heuristic) or "learned" (the network at MODEL_PATH)
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "value_model.npz")   # written by python learned.py train
+
+TT = TranspositionTable(TT_MEGABYTES, TT_POLICY)
+tt_game = {"moves": None, "shape": None, "model": None}
+
+
+# Helper function for agent: keeps TT for the whole game and clears it when a new game starts
+# (or the leaves are scored by another evaluator, whose values the table must not mix in)
+def game_table(position, config, model=None):
+    moves = position.num_moves()
+    shape = (config.rows, config.columns, config.inarow)
+    if tt_game["moves"] is None or moves < tt_game["moves"] or shape != tt_game["shape"] or model is not tt_game["model"]:
+        TT.clear()
+    tt_game["moves"], tt_game["shape"], tt_game["model"] = moves, shape, model
+    TT.new_search()
+    return TT
+
+
+book_state = {"book": None, "path": None}
+
+
+# Helper function for agent: the opening book at BOOK_PATH, memory-mapped on first use
+# (None if there is no book file or it was built for another board size)
+def opening_book(config):
+    if book_state["path"] != BOOK_PATH:
+        if book_state["book"] is not None:
+            book_state["book"].close()
+        book_state["book"] = OpeningBook(BOOK_PATH) if BOOK_PATH and os.path.exists(BOOK_PATH) else None
+        book_state["path"] = BOOK_PATH
+    book = book_state["book"]
+    return book if book is not None and book.matches(config) else None
+
+
+solver_state = {"solver": None, "shape": None}
+
+
+# Helper function for analyse: exact endgame solver, kept (with its table) between calls
+def endgame_solver(config):
+    shape = (config.rows, config.columns, config.inarow)
+    if solver_state["shape"] != shape:
+        solver_state["solver"] = Solver(config)
+        solver_state["shape"] = shape
+    return solver_state["solver"]
+
+
+model_state = {"model": None, "path": None}
+
+
+# Helper function for analyse: the learned.ValueModel at MODEL_PATH, loaded on first use
+def value_model(config):
+    if model_state["path"] != MODEL_PATH:
+        # imported here, so that the heuristic engine never loads the network code
+        from learned import ValueModel
+
+        model_state["model"] = ValueModel.load(MODEL_PATH)
+        model_state["path"] = MODEL_PATH
+    model = model_state["model"]
+    if (model.config.rows, model.config.columns, model.config.inarow) != (config.rows, config.columns, config.inarow):
+        raise ValueError("%s was trained for another board size" % MODEL_PATH)
+    return model
+
+
+search_state = {"searcher": None}
+
+
+# Helper function for analyse: alpha-beta searcher on the game's table, timed when stats is a SearchStats;
+# model (a learned.ValueModel or None for the heuristic) scores its leaves
+def game_searcher(mark, config, position, stats, model=None):
+    tt = game_table(position, config, model)
+    if stats is None:
+        searcher = Searcher(mark, config, tt, THREATS, THREAT_EXTENSION, model)
+    else:
+        searcher = TimedSearcher(mark, config, tt, stats, THREATS, THREAT_EXTENSION, model)
+        stats.begin(searcher)
+    search_state["searcher"] = searcher
+    return searcher
+
+
+# Stops the alpha-beta search of an analyse call running on another thread (the GUI's worker):
+# its deadline is moved into the past, so the search raises SearchTimeout within 64 nodes
+def interrupt():
+    searcher = search_state["searcher"]
+    if searcher is not None:
+        searcher.deadline = 0
+
+
+# Helper function for analyse: the opening book's move for mark, else the threat analysis'
+# forced move (win, block or only column), else None
+def known_move(position, mark, config):
+    book = opening_book(config)
+    if book is not None:
+        move = book.lookup(position, mark)
+        if move is not None:
+            return move
+    if THREATS:
+        return ThreatAnalyzer(config).forced_move(position, mark)
+    return None
+
+
+# Result of one search: the column to play, the score of every valid column, the depth searched,
+# for solved endgames the solver's Solution (game-theoretic value and distance to the end) and,
+# when statistics are on, the SearchStats record of the search
+SearchResult = collections.namedtuple("SearchResult", ["move", "scores", "depth", "solution", "stats"], defaults=(None, None))
+
+
+# Searches board (flat like obs.board, or 2D) once for mark and returns both the chosen
+# column and the per-column scores, so a caller that shows the scores (the GUI reward
+# panel) sees exactly what the move was based on. With exact=False only the best columns
+# are guaranteed exact scores, which is all agent needs. Opening positions take their move
+# from the book and forced moves (wins, blocks) from the threat analysis while the scores
+# still come from the search; with shortcut=True (agent) such a move returns at once with
+# no scores. The game's transposition table carries subtrees over to the following
+# positions. Once no more than ENDGAME_EMPTY cells are empty, the scores are exact solver
+# scores (positive wins, higher wins sooner).
+# stats (default SEARCH_STATS) adds the search statistics, also appended to STATS_LOG if set.
+# evaluator (default EVALUATOR) is "heuristic" or "learned" for the network at MODEL_PATH.
+def analyse(board, mark, config, nsteps=None, search=None, time_budget=None, workers=None, exact=True, stats=None,
+            evaluator=None, shortcut=False):
+    start = time.perf_counter()
+    # Convert the board to a bitboard position with incrementally updated window counts
+    if np.ndim(board) == 2:
+        position = Position.from_grid(board, config, incremental=True)
+        board = np.asarray(board).flatten().tolist()
+    else:
+        position = Position.from_board(board, config, incremental=True)
+    known = known_move(position, mark, config)
+    if known is not None and shortcut:
+        return SearchResult(known, {}, 0)
+    nsteps = N_STEPS if nsteps is None else nsteps
+    model = value_model(config) if (evaluator or EVALUATOR) == "learned" else None
+    time_budget = TIME_BUDGET if time_budget is None else time_budget
+    workers = WORKERS if workers is None else workers
+    stats = SearchStats(search or SEARCH) if (SEARCH_STATS if stats is None else stats) else None
+    # Get list of valid moves
+    valid_moves = position.valid_moves()
+    # Use the heuristic to assign a score to each possible board in the next step
+    scores = None
+    solution = None
+    depth = nsteps
+    empty = config.rows * config.columns - position.num_moves()
+    if empty <= ENDGAME_EMPTY and not position.is_terminal():
+        # small enough to solve: game-theoretic scores instead of the heuristic
+        solver = endgame_solver(config)
+        if stats is not None:
+            stats.search = "solver"
+            stats.begin(solver)
+        scores = solver.move_scores(position, mark)
+        if stats is not None:
+            stats.end(solver)
+        best = max(scores.values())
+        solution = solver.solution(best, position.num_moves(), None)
+        depth = empty
+    elif time_budget is not None:
+        # anytime mode: deepest search that completes within the budget
+        searcher = game_searcher(mark, config, position, stats, model)
+        scores, depth = searcher.iterative_deepening(position, time_budget, start=start, exact=exact)
+        if stats is not None:
+            stats.search = "iterative"
+            stats.end(searcher)
+    elif workers > 1 and model is None:
+        # root columns split over a process pool (None if the pool is unavailable); imported
+        # here so that a serial engine never loads multiprocessing
+        from parallel import parallel_root_scores
+
+        scores = parallel_root_scores(board, mark, config, nsteps, workers, TT_MEGABYTES, THREATS, THREAT_EXTENSION)
+        if stats is not None and scores is not None:
+            stats.search = "parallel"
+    if scores is None and (search or SEARCH) == "alphabeta":
+        searcher = game_searcher(mark, config, position, stats, model)
+        scores = searcher.root_scores(position, nsteps, exact=exact)
+        if stats is not None:
+            stats.end(searcher)
+    elif scores is None:
+        columns = mirror_reduced(position, valid_moves)
+        evaluate = None if model is None else model.evaluate_batch
+        scores = mirror_scores(position, dict(zip(columns, [score_move(position, col, mark, config, nsteps, search, evaluate) for col in columns])))
+    # Get a list of columns (moves) that maximize the heuristic, in column order whatever the search order
+    max_cols = [key for key in sorted(scores.keys()) if scores[key] == max(scores.values())]
+    # Select at random from the maximizing columns, unless the book or the threats give the move
+    move = random.choice(max_cols) if known is None else known
+    if solution is not None:
+        solution = solution._replace(move=move)
+    if stats is not None:
+        stats.depth = depth
+        stats.wall_time = time.perf_counter() - start
+        stats = stats.record()
+        if STATS_LOG:
+            log_stats(STATS_LOG, stats, mark=mark, moves=position.num_moves(), move=move)
+    return SearchResult(move, dict(sorted(scores.items())), depth, solution, stats)
+
+
+def agent(obs, config, search=None, time_budget=None, workers=None, evaluator=None):
+    # Opening positions come straight from the book, forced moves (wins, blocks) from the
+    # threat analysis; anything else is searched
+    return analyse(obs.board, obs.mark, config, search=search, time_budget=time_budget,
+                   workers=workers, exact=False, evaluator=evaluator, shortcut=True).move
@@ -0,0 +1,419 @@
+import collections
+import os
+import struct
+import time
+import types
+import zlib
+
+import numpy as np
+
+from bitboard import Position
+from search import Searcher
+from transposition import TranspositionTable
+
+
+RECORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "game_records.c4r")   # where the games and GUI append their games; None disables it
+ANALYSIS_DEPTH = 4   # Search depth the analyzer scores every position with
+LOSS_CAP = 1000   # Most a single move adds to the mean loss (a missed win or a lost game)
+WIN_SCORE = 1e5   # Scores above this are found wins (a won line is worth 1e6 in the heuristic)
+LOSS_SCORE = -5e3   # Scores below this are found losses (a lost line is worth -1e4)
+OPENING_PLIES = 8   # Moves of the opening kept in the index for prefix lookups
+OPENING_COLUMNS = 15   # Widest board whose openings fit the index (column + 1 in 4 bits)
+MAX_EXAMPLES = 20   # Blunders listed in the analysis report
+
+# File layout: FILE_HEADER once, then one record per game:
+#   RECORD_HEADER (length of the whole record, rows, columns, inarow, winner (0 draw, 1 or 2,
+#   -1 unfinished), number of moves, flags, creation time, name lengths of both agents),
+#   the two agent names in UTF-8, the columns packed into bits_per_move bits each (3 on the
+#   standard board), and with FLAG_TIMES one uint16 per move with its time in milliseconds.
+# Records are only ever appended; the index file next to it (path + ".idx") holds one
+# INDEX_DTYPE entry per record and can always be rebuilt from the records.
+MAGIC = b"C4GR"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sHH")
+RECORD_HEADER = struct.Struct("<IBBBbHHdBB")
+FLAG_TIMES = 1
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("winner", "i1"),
+    ("moves", "<u2"),
+    ("agent1", "<u4"),   # crc32 of the agent names
+    ("agent2", "<u4"),
+    ("opening", "<u4"),   # first OPENING_PLIES columns, 4 bits each (0 on boards wider than OPENING_COLUMNS)
+])
+
+# One game: board size as (rows, columns, inarow), the names of player 1 and player 2, the
+# winner (0 draw, 1 or 2, -1 unfinished), the columns played, seconds per move (or None)
+# and the unix time the game was written
+GameRecord = collections.namedtuple("GameRecord", ["shape", "agents", "winner", "moves", "times", "created"])
+
+
+# Helper function for the record functions: bits needed for one column of a board with columns columns
+def bits_per_move(columns):
+    return max(1, (columns - 1).bit_length())
+
+
+def agent_hash(name):
+    return zlib.crc32(name.encode())
+
+
+# Helper function for the index: the opening of a move list as one integer, 4 bits per move.
+# Wider boards than OPENING_COLUMNS do not fit and get 0, which no opening prefix matches.
+def opening_code(moves, columns=7):
+    if columns > OPENING_COLUMNS:
+        return 0
+    return sum((col + 1) << (4 * ply) for ply, col in enumerate(moves[:OPENING_PLIES]))
+
+
+def encode_record(record):
+    rows, columns, inarow = record.shape
+    names = [name.encode()[:255] for name in record.agents]
+    bits = bits_per_move(columns)
+    packed = sum(col << (bits * ply) for ply, col in enumerate(record.moves))
+    body = packed.to_bytes(-(-len(record.moves) * bits // 8), "little")
+    flags = 0
+    if record.times is not None:
+        flags |= FLAG_TIMES
+        body += np.minimum(np.round(np.asarray(record.times) * 1e3), 65535).astype("<u2").tobytes()
+    length = RECORD_HEADER.size + len(names[0]) + len(names[1]) + len(body)
+    header = RECORD_HEADER.pack(length, rows, columns, inarow, record.winner, len(record.moves), flags,
+                                record.created, len(names[0]), len(names[1]))
+    return header + names[0] + names[1] + body
+
+
+def decode_record(data):
+    (length, rows, columns, inarow, winner, num_moves, flags, created,
+     first_name, second_name) = RECORD_HEADER.unpack_from(data)
+    at = RECORD_HEADER.size
+    agents = (data[at:at + first_name].decode(), data[at + first_name:at + first_name + second_name].decode())
+    at += first_name + second_name
+    bits = bits_per_move(columns)
+    size = -(-num_moves * bits // 8)
+    packed = int.from_bytes(data[at:at + size], "little")
+    moves = [(packed >> (bits * ply)) & ((1 << bits) - 1) for ply in range(num_moves)]
+    at += size
+    times = None
+    if flags & FLAG_TIMES:
+        times = (np.frombuffer(data[at:at + 2 * num_moves], dtype="<u2") / 1e3).tolist()
+    return GameRecord((rows, columns, inarow), agents, winner, moves, times, created)
+
+
+# Helper function for iter_games and rebuild_index: yields (offset, record bytes) of every
+# complete record, reading the file front to back in constant memory
+def scan_records(path, start=FILE_HEADER.size):
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        while True:
+            head = f.read(4)
+            if len(head) < 4:
+                return
+            (length,) = struct.unpack("<I", head)
+            rest = f.read(length - 4)
+            if len(rest) < length - 4:
+                return  # a record cut short by a crash while it was being written
+            yield offset, head + rest
+            offset += length
+
+
+def index_entry(offset, record):
+    entry = np.zeros(1, dtype=INDEX_DTYPE)
+    entry["offset"] = offset
+    entry["winner"] = record.winner
+    entry["moves"] = len(record.moves)
+    entry["agent1"] = agent_hash(record.agents[0])
+    entry["agent2"] = agent_hash(record.agents[1])
+    entry["opening"] = opening_code(record.moves, record.shape[1])
+    return entry
+
+
+def rebuild_index(path):
+    """Writes path.idx again from the records and cuts off an incomplete last record"""
+    end = FILE_HEADER.size
+    with open(path + ".idx.tmp", "wb") as index:
+        for offset, data in scan_records(path):
+            index.write(index_entry(offset, decode_record(data)).tobytes())
+            end = offset + len(data)
+    os.replace(path + ".idx.tmp", path + ".idx")
+    if os.path.getsize(path) > end:
+        with open(path, "r+b") as f:
+            f.truncate(end)
+
+
+def load_index(path):
+    """The index of path as a read-only memory-mapped array (rebuilt first if it is out of date)"""
+    if not index_is_current(path):
+        rebuild_index(path)
+    if os.path.getsize(path + ".idx") == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.memmap(path + ".idx", dtype=INDEX_DTYPE, mode="r")
+
+
+# Helper function for load_index and GameWriter: True if the index covers exactly the records of path
+def index_is_current(path):
+    if not os.path.exists(path + ".idx"):
+        return False
+    size = os.path.getsize(path + ".idx")
+    if size % INDEX_DTYPE.itemsize:
+        return False
+    if size == 0:
+        return os.path.getsize(path) == FILE_HEADER.size
+    with open(path + ".idx", "rb") as f:
+        f.seek(size - INDEX_DTYPE.itemsize)
+        last = np.frombuffer(f.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+    with open(path, "rb") as f:
+        f.seek(int(last["offset"]))
+        head = f.read(4)
+    return len(head) == 4 and int(last["offset"]) + struct.unpack("<I", head)[0] == os.path.getsize(path)
+
+
+class GameWriter:
+    """Appends games to a record file and its index.
+
+    Both files are opened in append mode, so several games (or several runs) add to the
+    same store; every write is flushed, so a crash loses at most the game being written,
+    and an index that fell behind is rebuilt when the store is opened again.
+    """
+
+    def __init__(self, path=RECORDS_PATH):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) < FILE_HEADER.size:
+            with open(path, "wb") as f:
+                f.write(FILE_HEADER.pack(MAGIC, VERSION, 0))
+        with open(path, "rb") as f:
+            magic, version, _ = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d game record file" % (path, VERSION))
+        if not index_is_current(path):
+            rebuild_index(path)
+        self.data = open(path, "ab")
+        self.index = open(path + ".idx", "ab")
+
+    def write(self, moves, winner, agents=("unknown", "unknown"), config=None, times=None, created=None):
+        """Appends one game and returns its offset in the file"""
+        shape = (6, 7, 4) if config is None else (config.rows, config.columns, config.inarow)
+        moves = [int(col) for col in moves]
+        # a game lost on time, by an invalid column or by an error has a time for the move that was never played
+        times = None if times is None else list(times)[:len(moves)]
+        record = GameRecord(shape, tuple(agents), winner, moves, times, time.time() if created is None else created)
+        offset = self.data.tell()
+        self.data.write(encode_record(record))
+        self.data.flush()
+        self.index.write(index_entry(offset, record).tobytes())
+        self.index.flush()
+        return offset
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record_game(moves, winner, agents, config=None, times=None, path=RECORDS_PATH):
+    """Appends one game to the store at path (nothing if path is None)"""
+    if path is None:
+        return None
+    with GameWriter(path) as writer:
+        return writer.write(moves, winner, agents, config, times)
+
+
+# Name an agent is stored under: strings as they are ("random"), functions by module and
+# qualified name ("engine.agent", "mcts.agent"), so agents with the same function name differ
+def agent_name(agent):
+    if isinstance(agent, str):
+        return agent
+    name = getattr(agent, "__qualname__", None) or type(agent).__qualname__
+    module = getattr(agent, "__module__", None)
+    return name if module in (None, "__main__") else "%s.%s" % (module, name)
+
+
+def iter_games(path, offsets=None):
+    """
+    Yields (offset, GameRecord) for every game of path, or only for the given offsets (as
+    returned by find_games), reading one record at a time.
+    """
+    if offsets is None:
+        for offset, data in scan_records(path):
+            yield offset, decode_record(data)
+        return
+    with open(path, "rb") as f:
+        for offset in offsets:
+            f.seek(int(offset))
+            head = f.read(4)
+            (length,) = struct.unpack("<I", head)
+            yield int(offset), decode_record(head + f.read(length - 4))
+
+
+def find_games(path, winner=None, agent=None, prefix=None):
+    """
+    Offsets of the games of path that match every given filter: the winner (0 for draws),
+    an agent name playing either side, and an opening prefix (list of columns; only the
+    first OPENING_PLIES are compared; games on boards wider than OPENING_COLUMNS never match
+    one). Works on the index alone.
+    """
+    index = load_index(path)
+    match = np.ones(len(index), dtype=bool)
+    if winner is not None:
+        match &= index["winner"] == winner
+    if agent is not None:
+        code = agent_hash(agent)
+        match &= (index["agent1"] == code) | (index["agent2"] == code)
+    if prefix:
+        prefix = list(prefix)[:OPENING_PLIES]
+        if not all(0 <= col < OPENING_COLUMNS for col in prefix):
+            raise ValueError("opening prefixes can only hold columns 0 to %d" % (OPENING_COLUMNS - 1))
+        bits = (1 << (4 * len(prefix))) - 1
+        match &= (index["opening"] & bits) == opening_code(prefix)
+        match &= index["moves"] >= len(prefix)
+    return np.asarray(index["offset"][match])
+
+
+# Transposition table of the current worker process, kept for all the games it analyses
+# (openings repeat a lot, and mirrored positions share entries)
+worker_table = {"tt": None, "shape": None}
+
+
+# Runs in a worker process: for every move of the games, the loss against the best column at
+# depth, as (offset, agent name, ply, column, best column, loss, blunder, first) tuples, where
+# first marks the agent's first analysed move of the game (so its games can be counted)
+def analyse_chunk(games, depth):
+    results = []
+    for offset, record in games:
+        config = types.SimpleNamespace(rows=record.shape[0], columns=record.shape[1], inarow=record.shape[2])
+        if worker_table["tt"] is None or worker_table["shape"] != record.shape:
+            worker_table["tt"] = TranspositionTable(32)
+            worker_table["shape"] = record.shape
+        tt = worker_table["tt"]
+        position = Position(config, incremental=True)
+        mark = 1
+        for ply, col in enumerate(record.moves):
+            if position.is_terminal() or not position.can_play(col):
+                break
+            tt.new_search()
+            scores = Searcher(mark, config, tt).root_scores(position, depth, exact=True)
+            best_col = max(scores, key=lambda move: (scores[move], -abs(2*move - (config.columns-1))))
+            best, played = scores[best_col], scores[col]
+            loss = min(best - played, LOSS_CAP)
+            blunder = (best > LOSS_SCORE and played <= LOSS_SCORE) or (best >= WIN_SCORE and played < WIN_SCORE)
+            # in self-play both sides are the same agent, which then plays one game, not two
+            first = ply == 0 or (ply == 1 and record.agents[1] != record.agents[0])
+            results.append((offset, record.agents[mark - 1], ply, col, best_col, float(loss), bool(blunder), first))
+            position.play(col, mark)
+            mark = mark%2+1
+    return results
+
+
+def analyse_games(path, depth=ANALYSIS_DEPTH, workers=None, offsets=None, chunk_size=50, verbose=False):
+    """
+    Re-searches every position of the games in path (or of the given offsets) over a process
+    pool and returns a report per agent: games, moves, mean loss against the best column
+    (in heuristic units, capped at LOSS_CAP per move), blunders (a move that throws away a
+    found win or walks into a found loss) and the first MAX_EXAMPLES blunders. Games are
+    read and sent to the pool a chunk at a time, so memory stays flat for any number of games.
+    """
+    totals = collections.defaultdict(lambda: {"games": 0, "moves": 0, "loss": 0.0, "blunders": 0})
+    examples = []
+    start = time.perf_counter()
+    analysed = [0]
+
+    def collect(results):
+        for offset, name, ply, col, best_col, loss, blunder, first in results:
+            agent = totals[name]
+            agent["games"] += first
+            agent["moves"] += 1
+            agent["loss"] += loss
+            if blunder:
+                agent["blunders"] += 1
+                if len(examples) < MAX_EXAMPLES:
+                    examples.append({"offset": offset, "agent": name, "ply": ply, "played": col, "best": best_col})
+        analysed[0] += len(results)
+        if verbose:
+            print("%d positions analysed (%.0fs)" % (analysed[0], time.perf_counter() - start))
+
+    def chunks():
+        chunk = []
+        for game in iter_games(path, offsets):
+            chunk.append(game)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks():
+            collect(analyse_chunk(chunk, depth))
+    else:
+        # imported here, so that the games and the GUI that record games never load multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for chunk in chunks():
+                # a few chunks in flight at a time, so the games are streamed rather than loaded
+                if len(pending) >= 2 * workers:
+                    completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        collect(future.result())
+                pending.add(pool.submit(analyse_chunk, chunk, depth))
+            for future in pending:
+                collect(future.result())
+    agents = {name: {
+        "games": agent["games"],
+        "moves": agent["moves"],
+        "mean_loss": agent["loss"] / agent["moves"] if agent["moves"] else 0.0,
+        "blunders": agent["blunders"],
+        "blunder_rate": agent["blunders"] / agent["moves"] if agent["moves"] else 0.0,
+    } for name, agent in sorted(totals.items())}
+    return {"depth": depth, "positions": analysed[0], "agents": agents, "examples": examples}
+
+
+# Helper function for the kaggle runs: the columns and winner of a finished kaggle-environments
+# game from its steps (the board after every move and both agents' rewards)
+def kaggle_game(steps, columns):
+    moves = []
+    previous = steps[0][0]["observation"]["board"]
+    for step in steps[1:]:
+        board = step[0]["observation"]["board"]
+        changed = [cell for cell in range(len(board)) if board[cell] != previous[cell]]
+        if changed:
+            moves.append(changed[0] % columns)
+        previous = board
+    rewards = [state["reward"] for state in steps[-1]]
+    if rewards[0] == rewards[1]:
+        winner = 0 if rewards[0] is not None else -1
+    else:
+        winner = 1 if (rewards[0] or 0) > (rewards[1] or 0) else 2
+    return moves, winner
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Look up and analyse stored Connect Four games")
+    parser.add_argument("command", choices=["find", "analyse", "reindex"])
+    parser.add_argument("path", nargs="?", default=RECORDS_PATH)
+    parser.add_argument("--winner", type=int, default=None)
+    parser.add_argument("--agent", default=None)
+    parser.add_argument("--prefix", default=None, help="opening columns, e.g. 3324")
+    parser.add_argument("--depth", type=int, default=ANALYSIS_DEPTH)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    if args.command == "reindex":
+        rebuild_index(args.path)
+    else:
+        prefix = [int(col) for col in args.prefix] if args.prefix else None
+        offsets = find_games(args.path, args.winner, args.agent, prefix)
+        if args.command == "find":
+            for offset, record in iter_games(args.path, offsets):
+                print(offset, " vs ".join(record.agents), record.winner, "".join(str(col) for col in record.moves))
+        else:
+            filtered = args.winner is not None or args.agent or prefix
+            print(json.dumps(analyse_games(args.path, args.depth, args.workers, offsets if filtered else None), indent=1))
@@ -0,0 +1,384 @@
+import argparse
+import functools
+import os
+import time
+import types
+
+import numpy as np
+
+import engine
+from batchenv import BatchEnv
+from engine import window_index_table
+
+
+HIDDEN = 32   # Hidden units of the value network
+VALUE_SCALE = 1000   # Search score of a network value of 1 (a certain win not yet on the board)
+WIN_VALUE = 1e6   # Search score of a board with a line of the player searched for (minus for the opponent's)
+EVAL_CHUNK = 2048   # Boards per forward pass in evaluate_batch (keeps the one-hot features in cache)
+
+TRAIN_GAMES = 256   # Self-play games stepped together by the trainer
+TD_LAMBDA = 0.7   # Weight of the later positions of a game in the TD(lambda) target
+EPSILON = 0.1   # Chance of a random move in self-play
+LEARNING_RATE = 1e-3   # Step size of Adam
+BATCH_SIZE = 256   # Positions per update
+UPDATES_PER_STEP = 2   # Updates after each self-play move (about BATCH_SIZE/TRAIN_GAMES samples per position)
+REPLAY_CAPACITY = 2**20   # Positions kept in the replay buffer (about 50 bytes each on the standard board)
+
+
+# Helper function for ValueModel: the constant tables of the features of a board size.
+# Every window is scored by own + base * opponent pieces in one matrix product with
+# incidence (cells, windows); states maps that score to the state of the window: empty,
+# 1 to inarow-1 own pieces, 1 to inarow-1 opponent pieces, or dead (both players, or a line)
+@functools.lru_cache(maxsize=None)
+def feature_tables(rows, columns, inarow):
+    windows = window_index_table(rows, columns, inarow)
+    incidence = np.zeros((rows * columns, len(windows)), dtype=np.float32)
+    incidence[windows, np.arange(len(windows))[:, None]] = 1
+    base = inarow + 1
+    num_states = 2 * inarow
+    states = np.full(base * base, num_states - 1, dtype=np.intp)
+    states[np.arange(inarow)] = np.arange(inarow)
+    states[base * np.arange(1, inarow)] = np.arange(inarow, 2 * inarow - 1)
+    offsets = np.arange(len(windows)) * num_states
+    for table in (incidence, states, offsets):
+        table.flags.writeable = False
+    return incidence, states, offsets, base
+
+
+class ValueModel:
+    """Value network over window and cell features of a board, in plain NumPy.
+
+    A board is seen from the player `mark` the value is for: every window contributes a
+    one-hot state (empty, 1..inarow-1 of mark's pieces, 1..inarow-1 of the opponent's,
+    or dead), every cell a plane for mark's and for the opponent's pieces, and one
+    feature tells whether mark is to move. One ReLU hidden layer and a tanh output give
+    the value in (-1, 1), +1 being a win for mark. All methods work on stacks of boards
+    of shape (N, rows, columns) in the engine's layout; evaluate_batch is a drop-in for
+    engine.evaluate_batch (scores in search units and terminal flags).
+    """
+
+    def __init__(self, config, hidden=HIDDEN, rng=None):
+        rng = rng or np.random.default_rng()
+        self.config = types.SimpleNamespace(rows=config.rows, columns=config.columns, inarow=config.inarow)
+        self.cells = config.rows * config.columns
+        self.incidence, self.states, self.offsets, self.base = feature_tables(config.rows, config.columns, config.inarow)
+        self.num_windows = len(self.offsets)
+        self.num_features = self.num_windows * 2 * config.inarow + 2 * self.cells + 1
+        active = self.num_windows + self.cells + 1  # features that can be 1 at the same time, at most
+        self.w1 = (rng.standard_normal((self.num_features, hidden)) / np.sqrt(active)).astype(np.float32)
+        self.b1 = np.zeros(hidden, dtype=np.float32)
+        self.w2 = (rng.standard_normal(hidden) / np.sqrt(hidden)).astype(np.float32)
+        self.b2 = np.zeros(1, dtype=np.float32)
+        # bit of every grid cell (row 0 on top) in a Position's bitboards, for evaluate
+        height = config.rows + 1
+        self.cell_bits = np.array([col * height + config.rows - 1 - row
+                                   for row in range(config.rows) for col in range(config.columns)])
+        self.mask_bytes = -(-config.columns * height // 8)
+
+    def parameters(self):
+        return {"w1": self.w1, "b1": self.b1, "w2": self.w2, "b2": self.b2}
+
+    # One-hot features (N, num_features) of boards seen by marks, with flags for the boards that
+    # hold a line of mark, a line of the opponent, or no empty cell
+    def features(self, boards, marks):
+        flat = np.asarray(boards).reshape(-1, self.cells)
+        count = len(flat)
+        marks = np.broadcast_to(np.asarray(marks).reshape(-1, 1), (count, 1))
+        own = flat == marks
+        opp = (flat != 0) & ~own
+        sums = ((own + self.base * opp.astype(np.float32)) @ self.incidence).astype(np.intp)
+        features = np.zeros((count, self.num_features), dtype=np.float32)
+        features[np.arange(count)[:, None], self.states[sums] + self.offsets] = 1
+        cells = self.num_windows * 2 * self.config.inarow
+        features[:, cells:cells + self.cells] = own
+        features[:, cells + self.cells:cells + 2 * self.cells] = opp
+        # mark 1 is to move when both players have as many pieces
+        pieces = np.count_nonzero(flat, axis=1)
+        features[:, -1] = (pieces % 2 == 0) == (marks[:, 0] == 1)
+        won = (sums == self.config.inarow).any(axis=1)
+        lost = (sums == self.base * self.config.inarow).any(axis=1)
+        full = pieces == self.cells
+        return features, won, lost, full
+
+    # Values (N,) of feature rows, and the hidden activations that train needs for the gradient
+    def forward(self, features):
+        hidden = np.maximum(features @ self.w1 + self.b1, 0)
+        return np.tanh(hidden @ self.w2 + self.b2[0]), hidden
+
+    def values(self, boards, marks):
+        """Network values in (-1, 1) of boards for marks; boards with a line are +1 or -1, full boards 0"""
+        boards = np.asarray(boards)
+        marks = np.broadcast_to(np.asarray(marks).reshape(-1), (len(boards),))
+        values = np.empty(len(boards), dtype=np.float32)
+        for start in range(0, len(boards), EVAL_CHUNK):
+            chunk = slice(start, start + EVAL_CHUNK)
+            features, won, lost, full = self.features(boards[chunk], marks[chunk])
+            value = self.forward(features)[0]
+            values[chunk] = np.where(won, 1, np.where(lost, -1, np.where(full, 0, value)))
+        return values
+
+    # Same contract as engine.evaluate_batch: scores of boards for mark (one mark or one per
+    # board) and terminal flags. Scores are VALUE_SCALE * value, or +-WIN_VALUE for a line.
+    def evaluate_batch(self, boards, mark, config=None):
+        boards = np.asarray(boards)
+        marks = np.broadcast_to(np.asarray(mark).reshape(-1), (len(boards),))
+        scores = np.empty(len(boards))
+        terminal = np.empty(len(boards), dtype=bool)
+        for start in range(0, len(boards), EVAL_CHUNK):
+            chunk = slice(start, start + EVAL_CHUNK)
+            features, won, lost, full = self.features(boards[chunk], marks[chunk])
+            value = self.forward(features)[0]
+            scores[chunk] = np.where(won, WIN_VALUE, np.where(lost, -WIN_VALUE, np.where(full, 0, VALUE_SCALE * value)))
+            terminal[chunk] = won | lost | full
+        return scores, terminal
+
+    # Score of a bitboard Position for mark, in the units of evaluate_batch (used by Searcher).
+    # Same network as forward, but the hidden layer is summed from the rows of w1 of the active
+    # features, which is about three times faster than building the one-hot row of one board.
+    def evaluate(self, position, mark):
+        if position.is_win(mark):
+            return WIN_VALUE
+        if position.is_win(mark % 2 + 1):
+            return -WIN_VALUE
+        if position.is_full():
+            return 0.0
+        own, opp = self.cell_planes(position.masks[mark]), self.cell_planes(position.masks[mark % 2 + 1])
+        sums = ((own + self.base * opp) @ self.incidence).astype(np.intp)
+        cells = self.num_windows * 2 * self.config.inarow
+        hidden = (self.b1 + self.w1[self.states[sums] + self.offsets].sum(axis=0)
+                  + own @ self.w1[cells:cells + self.cells] + opp @ self.w1[cells + self.cells:cells + 2 * self.cells])
+        if (position.num_moves() % 2 == 0) == (mark == 1):
+            hidden += self.w1[-1]
+        return float(VALUE_SCALE * np.tanh(np.maximum(hidden, 0) @ self.w2 + self.b2[0]))
+
+    # Helper function for evaluate: the cells set in a bitboard, as a float plane in grid order
+    def cell_planes(self, mask):
+        bits = np.unpackbits(np.frombuffer(mask.to_bytes(self.mask_bytes, "little"), dtype=np.uint8), bitorder="little")
+        return bits[self.cell_bits].astype(np.float32)
+
+    def save(self, path, **extra):
+        """Writes the weights and the board size (and any extra arrays) to an .npz checkpoint"""
+        shape = np.array([self.config.rows, self.config.columns, self.config.inarow])
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, shape=shape, **self.parameters(), **extra)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            rows, columns, inarow = data["shape"].tolist()
+            model = cls(types.SimpleNamespace(rows=rows, columns=columns, inarow=inarow), hidden=len(data["b1"]))
+            for name, array in model.parameters().items():
+                array[...] = data[name]
+        return model
+
+
+class ReplayBuffer:
+    """Training positions in preallocated arrays, overwritten oldest first once full.
+
+    A position is a board, the mark its target is for and the target value. sample()
+    draws a batch of indices with one call and mirrors a random half of the boards,
+    which have the same value as the originals.
+    """
+
+    def __init__(self, capacity, config):
+        self.capacity = capacity
+        self.boards = np.zeros((capacity, config.rows, config.columns), dtype=np.int8)
+        self.marks = np.zeros(capacity, dtype=np.int8)
+        self.targets = np.zeros(capacity, dtype=np.float32)
+        self.next = 0  # slot the next position is written to
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, boards, marks, targets):
+        count = len(boards)
+        if count > self.capacity:
+            boards, marks, targets = boards[-self.capacity:], marks[-self.capacity:], targets[-self.capacity:]
+            count = self.capacity
+        slots = (self.next + np.arange(count)) % self.capacity
+        self.boards[slots] = boards
+        self.marks[slots] = marks
+        self.targets[slots] = targets
+        self.next = (self.next + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def sample(self, batch_size, rng):
+        index = rng.integers(0, self.size, batch_size)
+        boards = self.boards[index]
+        mirrored = rng.random(batch_size) < 0.5
+        boards[mirrored] = boards[mirrored, :, ::-1]
+        return boards, self.marks[index], self.targets[index]
+
+
+class TDTrainer:
+    """Trains a ValueModel by TD(lambda) on its own games.
+
+    TRAIN_GAMES games are played together in a BatchEnv. Every move scores all children of
+    every game in one batch and plays the best one for the player to move (a random one
+    with probability epsilon). When a game ends, each position after a move gets the
+    lambda-return for the player who made it, computed backwards from the result:
+    G_t = -((1 - lambda) * V_t+1 + lambda * G_t+1), where V_t+1 is the opponent's value of
+    the next position. After a random move the trace is cut and the target is the value
+    of the opponent's best reply instead (the Q-learning backup), so exploration does
+    not leak into the values. Each position goes into the ReplayBuffer for both players
+    (the opponent's target is the negated one), and the network is fitted to batches
+    sampled from it with Adam.
+    """
+
+    def __init__(self, model, games=TRAIN_GAMES, lam=TD_LAMBDA, epsilon=EPSILON, learning_rate=LEARNING_RATE,
+                 batch_size=BATCH_SIZE, capacity=REPLAY_CAPACITY, seed=None):
+        config = model.config
+        self.model = model
+        self.lam = lam
+        self.epsilon = epsilon
+        self.learning_rate = learning_rate
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.env = BatchEnv(games, config)
+        self.replay = ReplayBuffer(capacity, config)
+        self.rows, self.columns = config.rows, config.columns
+        # positions after every move of the running games, and the values that make their targets
+        plies = self.rows * self.columns
+        self.trail_boards = np.zeros((games, plies, self.rows, self.columns), dtype=np.int8)
+        self.trail_values = np.zeros((games, plies), dtype=np.float32)  # mover's value of the position
+        self.trail_best = np.zeros((games, plies), dtype=np.float32)  # mover's value of the best move
+        self.trail_random = np.zeros((games, plies), dtype=bool)
+        self.moments = {name: (np.zeros_like(array), np.zeros_like(array)) for name, array in model.parameters().items()}
+        self.updates = 0
+        self.games_played = 0
+        self.losses = []
+
+    # Plays one move in every game and stores the targets of the games that ended
+    def step(self):
+        env = self.env
+        legal = env.legal_mask()
+        parents, cols = np.nonzero(legal)
+        children = env.boards[parents]
+        children[np.arange(len(parents)), self.rows - 1 - env.heights[parents, cols], cols] = env.marks[parents]
+        values = np.full(legal.shape, -np.inf, dtype=np.float32)
+        values[parents, cols] = self.model.values(children, env.marks[parents])
+        # ties go to a random best column
+        best = np.argmax(values + self.rng.random(values.shape) * 1e-4, axis=1)
+        explore = self.rng.random(env.num_games) < self.epsilon
+        actions = np.where(explore, env.random_actions(self.rng), best)
+        games = env.games
+        ply = env.moves.copy()
+        self.trail_values[games, ply] = values[games, actions]
+        self.trail_best[games, ply] = values[games, best]
+        self.trail_random[games, ply] = explore & (actions != best)
+        child = np.full(legal.shape, -1)
+        child[parents, cols] = np.arange(len(parents))
+        self.trail_boards[games, ply] = children[child[games, actions]]
+        _, _, dones, _ = env.step(actions)
+        finished = np.flatnonzero(dones)
+        if len(finished):
+            self.store_games(finished, ply[finished] + 1)
+
+    # Helper function for step: lambda-returns of the finished games, added to the replay buffer
+    def store_games(self, games, lengths):
+        targets = np.zeros((len(games), lengths.max()), dtype=np.float32)
+        following = self.trail_values[games, lengths - 1]  # G of the last move: the result (1 win, 0 draw)
+        for ply in range(lengths.max() - 2, -1, -1):
+            inside = ply < lengths - 1
+            after = ply + 1
+            cut = self.trail_random[games, after]
+            target = np.where(cut, -self.trail_best[games, after],
+                              -((1 - self.lam) * self.trail_values[games, after] + self.lam * following))
+            targets[:, ply] = np.where(inside, target, 0)
+            following = np.where(inside, target, following)
+        # the position ending the game is terminal and scored by the rules, not the network
+        keep = np.arange(lengths.max()) < (lengths - 1)[:, None]
+        rows, plies = np.nonzero(keep)
+        boards = self.trail_boards[games[rows], plies]
+        movers = np.where(plies % 2 == 0, 1, 2).astype(np.int8)
+        target = targets[rows, plies]
+        self.replay.add(np.concatenate([boards, boards]), np.concatenate([movers, movers % 2 + 1]),
+                        np.concatenate([target, -target]))
+        self.games_played += len(games)
+
+    # One Adam step on a batch from the replay buffer; returns the mean squared error
+    def update(self):
+        boards, marks, targets = self.replay.sample(self.batch_size, self.rng)
+        model = self.model
+        features = model.features(boards, marks)[0]
+        values, hidden = model.forward(features)
+        error = values - targets
+        grad_out = 2 * error * (1 - values * values) / len(values)
+        grad_hidden = np.outer(grad_out, model.w2) * (hidden > 0)
+        grads = {
+            "w2": hidden.T @ grad_out,
+            "b2": np.array([grad_out.sum()], dtype=np.float32),
+            "w1": features.T @ grad_hidden,
+            "b1": grad_hidden.sum(axis=0),
+        }
+        self.updates += 1
+        beta1, beta2 = 0.9, 0.999
+        for name, array in model.parameters().items():
+            first, second = self.moments[name]
+            first *= beta1
+            first += (1 - beta1) * grads[name]
+            second *= beta2
+            second += (1 - beta2) * grads[name] ** 2
+            step = self.learning_rate * np.sqrt(1 - beta2 ** self.updates) / (1 - beta1 ** self.updates)
+            array -= (step * first / (np.sqrt(second) + 1e-8)).astype(np.float32)
+        return float(np.mean(error * error))
+
+    def train(self, games, updates_per_step=UPDATES_PER_STEP, checkpoint=None, verbose=False):
+        """
+        Self-plays until `games` more games have finished, updating the network after every
+        move once the replay buffer holds a batch. checkpoint (a path) is written about
+        every 10000 games and at the end.
+        """
+        start = time.perf_counter()
+        target = self.games_played + games
+        saved = self.games_played
+        while self.games_played < target:
+            self.step()
+            if len(self.replay) >= self.batch_size:
+                self.losses.extend(self.update() for _ in range(updates_per_step))
+            if self.games_played - saved >= 10000 or self.games_played >= target:
+                saved = self.games_played
+                if checkpoint:
+                    self.save(checkpoint)
+                if verbose:
+                    loss = np.mean(self.losses[-1000:]) if self.losses else float("nan")
+                    print("%d games, %d updates, loss %.4f (%.0fs)"
+                          % (self.games_played, self.updates, loss, time.perf_counter() - start))
+
+    # Checkpoints the weights with the number of games they were trained on (the optimizer
+    # state is not kept; a resumed run starts Adam afresh)
+    def save(self, path):
+        self.model.save(path, games=np.array([self.games_played]))
+
+
+# engine.agent with its search leaves scored by the network at engine.MODEL_PATH
+def agent(obs, config):
+    return engine.agent(obs, config, evaluator="learned")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the learned value network by self-play")
+    parser.add_argument("command", choices=["train", "match"])
+    parser.add_argument("--model", default=engine.MODEL_PATH)
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--resume", action="store_true", help="continue from the weights at --model")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    config = types.SimpleNamespace(rows=6, columns=7, inarow=4)
+    if args.command == "train":
+        model = ValueModel.load(args.model) if args.resume else ValueModel(config, rng=np.random.default_rng(args.seed))
+        trainer = TDTrainer(model, seed=args.seed)
+        if args.resume:
+            with np.load(args.model) as data:
+                trainer.games_played = int(data["games"][0]) if "games" in data else 0
+        trainer.train(args.games, checkpoint=args.model, verbose=True)
+    else:
+        # the learned evaluator against the heuristic, both in the engine's search
+        from tournament import print_report, run_tournament
+
+        engine.MODEL_PATH = args.model
+        print_report(run_tournament(agent, engine.agent, args.games, config, workers=args.workers,
+                                    seed=args.seed or 0))
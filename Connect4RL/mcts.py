@@ -0,0 +1,277 @@
+import math
+import random
+import time
+
+import numpy as np
+
+from bitboard import Position, board_tables, cell_window_table, has_line, winning_cells
+from search import center_order
+
+
+MCTS_ITERATIONS = 2000   # Iterations per move when no time budget is given
+MCTS_TIME_BUDGET = None   # Seconds per move; when set, agent searches until it runs out instead
+MCTS_CAPACITY = 2**18   # Most nodes the tree can hold (about 40 bytes each); full trees stop growing
+MCTS_POLICY = "puct"   # "uct" (UCB1) or "puct" (UCB weighted by a static prior per move)
+MCTS_ROLLOUT = "guided"   # "random" or "guided" (take immediate wins, block immediate losses)
+MCTS_EXPLORATION = 1.4   # Exploration constant of the UCT/PUCT formula
+
+NOT_TERMINAL = -1.0
+
+
+class MCTS:
+    """Monte Carlo tree search over bitboards with the tree kept in flat arrays.
+
+    Node i is described by entries i of the arrays: parent, move (column that leads to
+    it), first child and number of children (the children of a node are stored next
+    to each other), visits, summed result for the player who made the move, static
+    prior and, for nodes that end the game, their result. Results are 1 for a win,
+    0.5 for a draw and 0 for a loss. The arrays are allocated once with `capacity`
+    slots; when they are full the tree stops growing and iterations just roll out
+    from the existing leaves. advance() re-roots the tree on a later position of the
+    same game so that the subtree searched for it is kept.
+    """
+
+    def __init__(self, config, capacity=MCTS_CAPACITY, policy=MCTS_POLICY, rollout=MCTS_ROLLOUT,
+                 exploration=MCTS_EXPLORATION, rng=None):
+        if policy not in ("uct", "puct"):
+            raise ValueError("policy must be 'uct' or 'puct', got %r" % (policy,))
+        if rollout not in ("random", "guided"):
+            raise ValueError("rollout must be 'random' or 'guided', got %r" % (rollout,))
+        self.config = config
+        self.columns = config.columns
+        self.height = config.rows + 1
+        (self.directions, _, self.bottom,
+         self.column_masks, self.board_mask) = board_tables(config.rows, config.columns, config.inarow)
+        self.inarow = config.inarow
+        self.order = center_order(config.columns)
+        # static prior of a move: number of windows through the cell it fills
+        self.cell_priors = [len(windows) + 1 for windows in cell_window_table(config.rows, config.columns, config.inarow)]
+        self.capacity = capacity
+        self.policy = policy
+        self.guided = rollout == "guided"
+        self.exploration = exploration
+        self.rng = rng or random
+        self.parent = np.zeros(capacity, dtype=np.int32)
+        self.move = np.zeros(capacity, dtype=np.int8)
+        self.first = np.zeros(capacity, dtype=np.int32)
+        self.count = np.zeros(capacity, dtype=np.int8)
+        self.visits = np.zeros(capacity, dtype=np.float64)
+        self.value = np.zeros(capacity, dtype=np.float64)
+        self.prior = np.zeros(capacity, dtype=np.float32)
+        self.terminal = np.zeros(capacity, dtype=np.float32)
+        self.iterations = 0
+        self.reset(0, 0)
+
+    # Empties the tree and makes (current, mask) the root: current holds the pieces of the
+    # player to move, mask every piece
+    def reset(self, current, mask):
+        self.size = 1
+        self.root = 0
+        self.root_current, self.root_mask = current, mask
+        self.init_node(0, -1, -1, 1.0, NOT_TERMINAL)
+
+    def init_node(self, node, parent, move, prior, terminal):
+        self.parent[node] = parent
+        self.move[node] = move
+        self.first[node] = -1
+        self.count[node] = 0
+        self.visits[node] = 0
+        self.value[node] = 0
+        self.prior[node] = prior
+        self.terminal[node] = terminal
+
+    # Makes position (mark to move) the root, keeping the subtree when position follows from
+    # the current root within two plies; otherwise starts a new tree
+    def set_root(self, position, mark):
+        current, mask = position.masks[mark], position.masks[1] | position.masks[2]
+        if (current, mask) == (self.root_current, self.root_mask):
+            return
+        node = self.find(current, mask)
+        if node is None:
+            self.reset(current, mask)
+        else:
+            self.compact(node)
+            self.root_current, self.root_mask = current, mask
+
+    # Helper function for set_root: node reached from the root by at most two moves whose
+    # position is (current, mask), or None
+    def find(self, current, mask):
+        frontier = [(self.root, self.root_current, self.root_mask)]
+        for _ in range(2):
+            next_frontier = []
+            for node, own, pieces in frontier:
+                for child in range(self.first[node], self.first[node] + self.count[node]):
+                    bit = (pieces + self.bottom) & self.column_masks[self.move[child]]
+                    state = (own ^ pieces, pieces | bit)
+                    if state == (current, mask):
+                        return child
+                    next_frontier.append((child,) + state)
+            frontier = next_frontier
+        return None
+
+    # Helper function for set_root: moves the subtree of node to the front of the arrays (node
+    # becomes 0), so the rest of the capacity is free again
+    def compact(self, node):
+        keep = [np.array([node])]
+        frontier = keep[0]
+        while frontier.size:
+            expanded = frontier[self.first[frontier] >= 0]
+            starts, counts = self.first[expanded], self.count[expanded].astype(np.int64)
+            # children of each expanded node, block after block in frontier order
+            frontier = (np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum()))
+            keep.append(frontier)
+        old = np.concatenate(keep)
+        remap = np.full(self.capacity, -1, dtype=np.int32)
+        remap[old] = np.arange(old.size)
+        for array in (self.move, self.count, self.visits, self.value, self.prior, self.terminal):
+            array[:old.size] = array[old]
+        first = self.first[old]
+        parent = self.parent[old]
+        self.first[:old.size] = np.where(first >= 0, remap[np.maximum(first, 0)], -1)
+        self.parent[:old.size] = np.where(parent >= 0, remap[np.maximum(parent, 0)], -1)
+        self.parent[0] = -1
+        self.size = old.size
+        self.root = 0
+
+    # Runs iterations until `iterations` are done or time_budget seconds have passed, but at
+    # least one, so the root has been expanded
+    def search(self, iterations=None, time_budget=None):
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        done = 0
+        while not done or (iterations is None or done < iterations) and (deadline is None or time.perf_counter() < deadline):
+            self.iterate()
+            done += 1
+        self.iterations += done
+        return done
+
+    # One selection, expansion, rollout and backup
+    def iterate(self):
+        node, current, mask = self.root, self.root_current, self.root_mask
+        path = [node]
+        while self.first[node] >= 0 and self.terminal[node] == NOT_TERMINAL:
+            node = self.select_child(node)
+            current, mask = self.play(current, mask, self.move[node])
+            path.append(node)
+        if self.terminal[node] == NOT_TERMINAL and (self.visits[node] > 0 or node == self.root):
+            if self.expand(node, current, mask):
+                node = self.select_child(node)
+                current, mask = self.play(current, mask, self.move[node])
+                path.append(node)
+        if self.terminal[node] != NOT_TERMINAL:
+            result = float(self.terminal[node])
+        else:
+            # the rollout result is for the player to move at node, not the one who moved into it
+            result = 1.0 - self.rollout(current, mask)
+        for node in reversed(path):
+            self.visits[node] += 1
+            self.value[node] += result
+            result = 1.0 - result
+
+    # Helper function for iterate: child with the best UCT/PUCT score
+    def select_child(self, node):
+        first = self.first[node]
+        children = slice(first, first + self.count[node])
+        visits = self.visits[children]
+        total = self.visits[node]
+        mean = np.divide(self.value[children], visits, out=np.full(visits.shape, 0.5), where=visits > 0)
+        if self.policy == "uct":
+            bonus = self.exploration * np.sqrt(math.log(total + 1) / np.maximum(visits, 1))
+            bonus[visits == 0] = np.inf
+        else:
+            bonus = self.exploration * self.prior[children] * math.sqrt(total + 1) / (1 + visits)
+        return first + int(np.argmax(mean + bonus))
+
+    # Helper function for iterate: adds the children of node, or returns False if the tree is full
+    def expand(self, node, current, mask):
+        possible = (mask + self.bottom) & self.board_mask
+        moves = [(col, possible & self.column_masks[col]) for col in self.order if possible & self.column_masks[col]]
+        if self.size + len(moves) > self.capacity:
+            return False
+        wins = winning_cells(current, mask, self.directions, self.inarow, self.board_mask)
+        priors = [self.cell_priors[bit.bit_length() - 1] for _, bit in moves]
+        total = sum(priors)
+        first = self.size
+        for i, (col, bit) in enumerate(moves):
+            if wins & bit:
+                terminal = 1.0
+            elif (mask | bit) == self.board_mask:
+                terminal = 0.5
+            else:
+                terminal = NOT_TERMINAL
+            self.init_node(first + i, node, col, priors[i] / total, terminal)
+        self.first[node] = first
+        self.count[node] = len(moves)
+        self.size += len(moves)
+        return True
+
+    # Helper function for iterate: position after the player to move drops a piece in col
+    def play(self, current, mask, col):
+        bit = (mask + self.bottom) & self.column_masks[col]
+        return current ^ mask, mask | bit
+
+    # Plays the game out from (current, mask) and returns the result for the player to move.
+    # Random rollouts play random columns; guided ones take a winning move when there is
+    # one and otherwise block the opponent's immediate win.
+    def rollout(self, current, mask):
+        sign = 0  # 0 while the player to move at the start is on move
+        while True:
+            possible = (mask + self.bottom) & self.board_mask
+            if not possible:
+                return 0.5
+            move = 0
+            if self.guided:
+                if winning_cells(current, mask, self.directions, self.inarow, self.board_mask) & possible:
+                    return 1.0 if sign == 0 else 0.0
+                threats = winning_cells(current ^ mask, mask, self.directions, self.inarow, self.board_mask) & possible
+                move = threats & -threats
+            if not move:
+                move = possible & self.column_masks[self.rng.choice(
+                    [col for col in self.order if possible & self.column_masks[col]])]
+                if not self.guided and has_line(current | move, self.directions, self.inarow):
+                    return 1.0 if sign == 0 else 0.0
+            current, mask = current ^ mask, mask | move
+            sign ^= 1
+
+    # Visits of every root move as {col: visits}
+    def root_visits(self):
+        first = self.first[self.root]
+        if first < 0:
+            return {}
+        return {int(self.move[child]): int(self.visits[child])
+                for child in range(first, first + self.count[self.root])}
+
+    # Most visited root move; ties are broken at random. Without any root children (the tree
+    # was full when the root had to be expanded) it is the most central legal move.
+    def best_move(self):
+        visits = self.root_visits()
+        if not visits:
+            possible = (self.root_mask + self.bottom) & self.board_mask
+            return next(col for col in self.order if possible & self.column_masks[col])
+        best = max(visits.values())
+        return self.rng.choice(sorted(col for col in visits if visits[col] == best))
+
+
+mcts_state = {"tree": None, "shape": None}
+
+
+# Helper function for agent: the tree of the current game, made for the board size
+def game_tree(config):
+    shape = (config.rows, config.columns, config.inarow)
+    if mcts_state["shape"] != shape:
+        mcts_state["tree"] = MCTS(config)
+        mcts_state["shape"] = shape
+    return mcts_state["tree"]
+
+
+def agent(obs, config, iterations=None, time_budget=None):
+    """
+    MCTS player with the same interface as engine.agent. The tree is kept between calls
+    and re-rooted on the new position, so the search of the previous move carries over.
+    """
+    time_budget = MCTS_TIME_BUDGET if time_budget is None else time_budget
+    if iterations is None and time_budget is None:
+        iterations = MCTS_ITERATIONS
+    tree = game_tree(config)
+    tree.set_root(Position.from_board(obs.board, config), obs.mark)
+    tree.search(iterations, time_budget)
+    return tree.best_move()
@@ -0,0 +1,71 @@
+import atexit
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bitboard import Position
+from search import Searcher, center_order, mirror_reduced, mirror_scores
+from transposition import TranspositionTable
+
+
+# Process pool shared by every parallel search; it is started on first use and kept
+# alive between moves so a move never pays the process spawn cost
+pool_state = {"pool": None, "workers": 0}
+
+# Transposition table of the current worker process, kept between moves like engine.TT
+worker_table = {"tt": None, "shape": None, "threats": None}
+
+
+# Helper function for parallel_root_scores: returns the pool, (re)starting it if the size changed
+def get_pool(workers):
+    if pool_state["pool"] is None or pool_state["workers"] != workers:
+        shutdown_pool()
+        pool_state["pool"] = ProcessPoolExecutor(max_workers=workers)
+        pool_state["workers"] = workers
+    return pool_state["pool"]
+
+
+def shutdown_pool():
+    if pool_state["pool"] is not None:
+        pool_state["pool"].shutdown(cancel_futures=True)
+        pool_state["pool"] = None
+        pool_state["workers"] = 0
+
+
+atexit.register(shutdown_pool)
+
+
+# Runs in a worker process: full-window alpha-beta value of dropping mark in col
+def score_column(board, col, mark, shape, depth, tt_megabytes, threats=False, extension=4):
+    rows, columns, inarow = shape
+    config = types.SimpleNamespace(rows=rows, columns=columns, inarow=inarow)
+    # values searched with and without threats differ, so they never share a table
+    if worker_table["tt"] is None or worker_table["shape"] != shape or worker_table["threats"] != (threats, extension):
+        worker_table["tt"] = TranspositionTable(tt_megabytes)
+        worker_table["shape"] = shape
+        worker_table["threats"] = (threats, extension)
+    tt = worker_table["tt"]
+    tt.new_search()
+    position = Position.from_board(board, config, incremental=True)
+    return Searcher(mark, config, tt, threats, extension).score_move(position, col, depth)
+
+
+# Root-parallel search: the valid columns are split over the worker processes and each
+# is searched with a full window. The scores are exact, so the best columns are the same
+# as in the serial search (with the same threats settings). Returns None if the pool cannot
+# be used, so the caller can fall back to the serial search.
+def parallel_root_scores(board, mark, config, depth, workers, tt_megabytes=16, threats=False, extension=4):
+    shape = (config.rows, config.columns, config.inarow)
+    # on a symmetric board one column of each mirror pair is enough
+    position = Position.from_board(board, config)
+    valid_moves = mirror_reduced(position, [col for col in center_order(config.columns) if board[col] == 0])
+    board = tuple(board)
+    try:
+        pool = get_pool(workers)
+        futures = {col: pool.submit(score_column, board, col, mark, shape, depth, tt_megabytes,
+                                    threats, extension)
+                   for col in valid_moves}
+        return mirror_scores(position, {col: future.result() for col, future in futures.items()})
+    except (OSError, BrokenProcessPool):
+        shutdown_pool()
+        return None
@@ -0,0 +1,272 @@
+import time
+
+import numpy as np
+
+from bitboard import zobrist_keys
+from transposition import EXACT, LOWER, UPPER
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the deadline of an iterative-deepening run passes."""
+
+
+# Helper function for Searcher: columns sorted from the center outwards (3, 2, 4, 1, 5, 0, 6)
+def center_order(columns):
+    return sorted(range(columns), key=lambda col: (abs(2*col - (columns-1)), col))
+
+
+# Helper function for root searches: moves without the right-hand twin of each mirror pair when
+# position is its own mirror (col and columns-1-col then have the same score)
+def mirror_reduced(position, moves):
+    if not position.is_symmetric():
+        return list(moves)
+    return [col for col in moves if 2*col <= position.columns - 1]
+
+
+# Helper function for root searches: scores of a mirror_reduced search with the skipped twins filled in
+def mirror_scores(position, scores):
+    full = dict(scores)
+    if position.is_symmetric():
+        for col, score in scores.items():
+            full[position.columns - 1 - col] = score
+    return full
+
+
+class Searcher:
+    """Alpha-beta version of engine.minimax on a bitboard Position.
+
+    Values are always from the point of view of `mark`, exactly like minimax, and at
+    equal depth the search returns the same value as the plain minimax. Moves are
+    tried in the order: immediate wins, forced blocks, killer moves of the ply,
+    history score, center-first. Killer and history tables live as long as the
+    Searcher, so one instance should be reused for all root moves of a search.
+
+    With a TranspositionTable, values are only reused when they were searched to
+    the same remaining depth (deeper values would change the result compared to
+    minimax); entries of any depth still supply the first move to try. A position
+    and its mirror have the same value, so both share one entry under the smaller of
+    their hashes, and on a symmetric board only one column of each mirror pair is
+    searched at the root.
+
+    threats=True gives up the equality with minimax for a ThreatAnalyzer: inside the
+    tree only the wins, the blocks of playable threats, or the moves that do not play
+    under an opponent's winning cell are searched, and a leaf where a win or a block is
+    due follows the forced lines for up to `extension` plies and takes their value if
+    the game ends on all of them. Both consider every win and block rather than the
+    first by column, so a position and its mirror still have the same value. Heuristic
+    leaves add the Zugzwang parity of the threats (ThreatAnalyzer.parity_score).
+
+    With a model (a learned.ValueModel), leaves are scored by the network instead of the
+    heuristic; the search itself is unchanged.
+    """
+
+    def __init__(self, mark, config, tt=None, threats=False, extension=4, model=None):
+        self.mark = mark
+        self.opponent = mark%2+1
+        self.tt = tt
+        self.mark_key = zobrist_keys(config.rows, config.columns)[1][mark]
+        self.columns = config.columns
+        self.order = center_order(config.columns)
+        self.killers = {}  # ply -> up to two moves that caused a cutoff
+        self.history = [[0] * config.columns for _ in range(3)]  # indexed by mark, then column
+        self.nodes = 0
+        self.leaves = 0  # nodes scored with the heuristic (depth 0 or game over)
+        self.terminal_checks = 0
+        self.cutoffs = 0
+        self.deadline = None  # perf_counter() time after which the search raises SearchTimeout
+        self.threats = None
+        if threats:
+            # imported here, the threat module builds on this one
+            from threats import ThreatAnalyzer
+
+            self.threats = ThreatAnalyzer(config)
+        self.extension = extension
+        self.model = model
+
+    # Value of the position after the root move, searched with the full window
+    def score_move(self, position, col, depth):
+        position.play(col, self.mark)
+        score = self.alphabeta(position, depth-1, -np.inf, np.inf, False, 1)
+        position.undo()
+        return score
+
+    # Scores of all root moves. The best moves get exact scores; unless exact is set, every
+    # other move is searched against the best score so far, so its score is only an upper
+    # bound. order overrides the move ordering at the root.
+    def root_scores(self, position, depth, order=None, exact=False):
+        scores = {}
+        best = -np.inf
+        for col in mirror_reduced(position, order or self.ordered_moves(position, self.mark, 0)):
+            position.play(col, self.mark)
+            # heuristic values are integers, so a window just below the best score
+            # still returns exact values for moves that tie with it
+            alpha = -np.inf if exact else best - 1
+            score = self.alphabeta(position, depth-1, alpha, np.inf, False, 1)
+            position.undo()
+            scores[col] = score
+            best = max(best, score)
+        return mirror_scores(position, scores)
+
+    # Anytime search: runs root_scores at depth 1, 2, ... until time_budget seconds have
+    # passed (or max_depth / the end of the game is reached) and returns the scores of
+    # the deepest completed iteration together with that depth. Each iteration tries
+    # the previous iteration's moves best-first; depth 1 always completes, unless
+    # engine.interrupt stops it with SearchTimeout.
+    def iterative_deepening(self, position, time_budget, max_depth=None, start=None, exact=False):
+        start = time.perf_counter() if start is None else start
+        empty = position.rows * position.columns - position.num_moves()
+        max_depth = empty if max_depth is None else min(max_depth, empty)
+        scores = self.root_scores(position, 1, exact=exact)
+        depth = 1
+        # an interrupt during depth 1 has already moved the deadline, which must stand
+        self.deadline = start + time_budget if self.deadline is None else min(self.deadline, start + time_budget)
+        played = len(position.history)
+        try:
+            while depth < max_depth and time.perf_counter() < self.deadline:
+                order = sorted(scores, key=lambda col: -scores[col])
+                scores = self.root_scores(position, depth+1, order, exact)
+                depth += 1
+        except SearchTimeout:
+            while len(position.history) > played:
+                position.undo()
+        finally:
+            self.deadline = None
+        return scores, depth
+
+    def alphabeta(self, position, depth, alpha, beta, maximizingPlayer, ply):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 63 and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+        if depth != 0:
+            self.terminal_checks += 1
+        if depth == 0 or position.is_terminal():
+            self.leaves += 1
+            if depth == 0 and self.threats is not None and not position.is_terminal():
+                value = self.forced_line(position, maximizingPlayer, self.extension)
+                if value is not None:
+                    return value
+            return self.evaluate(position)
+        tt_move = None
+        if self.tt is not None:
+            key, mirrored = position.canonical_hash()
+            key ^= self.mark_key
+            entry = self.tt.probe(key)
+            if entry is not None:
+                tt_value, tt_depth, bound, tt_move = entry
+                if tt_depth == depth and (bound == EXACT or (bound == LOWER and tt_value >= beta)
+                                          or (bound == UPPER and tt_value <= alpha)):
+                    return tt_value
+                if mirrored and tt_move is not None:
+                    tt_move = self.columns - 1 - tt_move
+            alpha_orig, beta_orig = alpha, beta
+        player = self.mark if maximizingPlayer else self.opponent
+        if self.threats is None:
+            moves = self.ordered_moves(position, player, ply, tt_move)
+        else:
+            moves = self.threats.prune_moves(position, player, [col for col in self.order if position.can_play(col)])
+            if len(moves) > 1:
+                moves = self.ordered_moves(position, player, ply, tt_move, moves)
+        best_move = None
+        if maximizingPlayer:
+            value = -np.inf
+            for col in moves:
+                position.play(col, player)
+                child = self.alphabeta(position, depth-1, alpha, beta, False, ply+1)
+                position.undo()
+                if child > value:
+                    value, best_move = child, col
+                if value >= beta:
+                    self.record_cutoff(player, col, depth, ply)
+                    break
+                alpha = max(alpha, value)
+        else:
+            value = np.inf
+            for col in moves:
+                position.play(col, player)
+                child = self.alphabeta(position, depth-1, alpha, beta, True, ply+1)
+                position.undo()
+                if child < value:
+                    value, best_move = child, col
+                if value <= alpha:
+                    self.record_cutoff(player, col, depth, ply)
+                    break
+                beta = min(beta, value)
+        if self.tt is not None:
+            if value <= alpha_orig:
+                bound = UPPER
+            elif value >= beta_orig:
+                bound = LOWER
+            else:
+                bound = EXACT
+            if mirrored and best_move is not None:
+                best_move = self.columns - 1 - best_move
+            self.tt.store(key, value, depth, bound, best_move)
+        return value
+
+    # Helper function for alphabeta: value of a leaf for mark; the threat search adds the
+    # odd/even threat parity to the heuristic
+    def evaluate(self, position):
+        if self.model is not None:
+            return self.model.evaluate(position, self.mark)
+        if self.threats is not None:
+            return position.heuristic(self.mark) + self.threats.parity_score(position, self.mark)
+        return position.heuristic(self.mark)
+
+    # Helper function for alphabeta: value of the game ends reached by the forced moves (the
+    # wins, else the blocks of the opponent's threats) from a leaf, the best of them for the
+    # side to move, or None if a line gets quiet or runs longer than plies
+    def forced_line(self, position, maximizingPlayer, plies):
+        if plies == 0:
+            return None
+        player = self.mark if maximizingPlayer else self.opponent
+        moves = self.threats.forcing_moves(position, player)
+        if not moves:
+            return None
+        values = []
+        for col in moves:
+            position.play(col, player)
+            self.nodes += 1
+            if position.is_terminal():
+                value = self.evaluate(position)
+            else:
+                value = self.forced_line(position, not maximizingPlayer, plies-1)
+            position.undo()
+            if value is None:
+                return None
+            values.append(value)
+        return max(values) if maximizingPlayer else min(values)
+
+    # Helper function for alphabeta: valid moves for player, most promising first. candidates
+    # (center-first) are moves left by the threat analysis, which holds no wins or blocks
+    def ordered_moves(self, position, player, ply, tt_move=None, candidates=None):
+        other = player%2+1
+        killers = self.killers.get(ply, ())
+        history = self.history[player]
+        keyed = []
+        for rank, col in enumerate(candidates or self.order):
+            if not position.can_play(col):
+                continue
+            if col == tt_move:
+                bucket = 0
+            elif candidates is not None:
+                bucket = 3 if col in killers else 4
+            elif position.is_winning_move(col, player):
+                bucket = 1
+            elif position.is_winning_move(col, other):
+                bucket = 2
+            elif col in killers:
+                bucket = 3
+            else:
+                bucket = 4
+            keyed.append((bucket, -history[col], rank, col))
+        keyed.sort()
+        return [col for _, _, _, col in keyed]
+
+    # Helper function for alphabeta: remembers a move that refuted the position
+    def record_cutoff(self, player, col, depth, ply):
+        self.cutoffs += 1
+        killers = self.killers.setdefault(ply, [])
+        if col not in killers:
+            killers.insert(0, col)
+            del killers[2:]
+        self.history[player][col] += depth * depth
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import random
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from bitboard import Position
+from search import Searcher
+from transposition import TranspositionTable
+
+
+MANIFEST = "manifest.json"
+VERSION = 1
+
+
+# One record per position of a self-play game, from the point of view of the side to move:
+# the board before the move (engine grid layout, row 0 on top), who moves, the column played,
+# the search score of every column (NaN for full columns) and the final result for mark
+def record_dtype(config):
+    return np.dtype([
+        ("board", np.int8, (config.rows, config.columns)),
+        ("mark", np.int8),
+        ("move", np.int8),
+        ("scores", np.float32, (config.columns,)),
+        ("outcome", np.int8),   # 1 win, 0 draw, -1 loss
+        ("ply", np.int8),
+        ("game", np.int32),
+    ])
+
+
+# Helper function for generate_shard: plays one game into records[start:] and returns the
+# number of positions written. Each move is searched like agent does (alpha-beta with the
+# game's table, exact scores for every column); with probability epsilon, and for the first
+# random_plies plies, the move is a random valid column instead of a best one.
+def play_game(records, start, game, config, depth, epsilon, random_plies, rng, tt):
+    position = Position(config, incremental=True)
+    tt.clear()
+    count = 0
+    winner = 0
+    while not position.is_terminal():
+        mark = position.num_moves() % 2 + 1
+        tt.new_search()
+        scores = Searcher(mark, config, tt).root_scores(position, depth, exact=True)
+        if position.num_moves() < random_plies or rng.random() < epsilon:
+            move = rng.choice(position.valid_moves())
+        else:
+            best = max(scores.values())
+            move = rng.choice(sorted(col for col in scores if scores[col] == best))
+        record = records[start + count]
+        record["board"] = position.to_grid()
+        record["mark"] = mark
+        record["move"] = move
+        record["scores"] = [scores.get(col, np.nan) for col in range(config.columns)]
+        record["ply"] = position.num_moves()
+        record["game"] = game
+        count += 1
+        position.play(move, mark)
+        if position.is_win(mark):
+            winner = mark
+    played = records[start:start + count]
+    played["outcome"] = 0 if winner == 0 else np.where(played["mark"] == winner, 1, -1)
+    return count
+
+
+# Runs in a worker process: plays the games of one shard and saves their positions to
+# shard-<index>.npy. Memory use is one shard buffer, whatever the size of the dataset.
+def generate_shard(directory, index, first_game, games, shape, depth, epsilon, random_plies, seed):
+    rows, columns, inarow = shape
+    config = types.SimpleNamespace(rows=rows, columns=columns, inarow=inarow)
+    rng = random.Random(seed + index)
+    tt = TranspositionTable(16)
+    records = np.zeros(games * rows * columns, dtype=record_dtype(config))
+    count = 0
+    for game in range(first_game, first_game + games):
+        count += play_game(records, count, game, config, depth, epsilon, random_plies, rng, tt)
+    name = "shard-%05d.npy" % index
+    tmp_path = os.path.join(directory, name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, records[:count])
+    os.replace(tmp_path, os.path.join(directory, name))
+    return {"index": index, "file": name, "games": games, "records": count}
+
+
+# Helper function for generate: writes the manifest so that a crash never leaves half a file
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def generate(directory, games, config, depth=3, epsilon=0.1, random_plies=2, games_per_shard=100,
+             workers=None, seed=0, verbose=False):
+    """
+    Generates self-play data in directory until it holds `games` games, in shards of
+    games_per_shard games each. Shards already listed in the manifest are kept, so an
+    interrupted run continues where it stopped and a larger `games` extends the dataset.
+    Shard i always holds games i*games_per_shard onwards, seeded with seed + i.
+
+    Returns the manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    settings = {
+        "version": VERSION,
+        "shape": [config.rows, config.columns, config.inarow],
+        "dtype": record_dtype(config).descr,
+        "depth": depth,
+        "epsilon": epsilon,
+        "random_plies": random_plies,
+        "games_per_shard": games_per_shard,
+        "seed": seed,
+    }
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        manifest = load_manifest(directory)
+        old = {key: manifest[key] for key in settings}
+        if json.loads(json.dumps(settings)) != old:
+            raise ValueError("%s was generated with different settings: %s" % (directory, old))
+    else:
+        manifest = dict(settings, shards=[])
+    # a last shard from a smaller run is regenerated with its full number of games
+    manifest["shards"] = [shard for shard in manifest["shards"]
+                          if shard["games"] >= min(games_per_shard, games - shard["index"] * games_per_shard)]
+    done = {shard["index"] for shard in manifest["shards"]}
+    todo = [index for index in range(-(-games // games_per_shard)) if index not in done]
+    shape = (config.rows, config.columns, config.inarow)
+
+    def shard_args(index):
+        first_game = index * games_per_shard
+        return (directory, index, first_game, min(games_per_shard, games - first_game), shape,
+                depth, epsilon, random_plies, seed)
+
+    def finished(shard):
+        manifest["shards"] = sorted(manifest["shards"] + [shard], key=lambda shard: shard["index"])
+        save_manifest(directory, manifest)
+        if verbose:
+            total = sum(shard["records"] for shard in manifest["shards"])
+            print("shard %d: %d positions (%d shards, %d positions, %.0fs)"
+                  % (shard["index"], shard["records"], len(manifest["shards"]), total, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for index in todo:
+            finished(generate_shard(*shard_args(index)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for index in todo:
+                # only a few shards in flight at once, so memory stays flat for any dataset size
+                if len(pending) >= 2 * workers:
+                    completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        finished(future.result())
+                pending.add(pool.submit(generate_shard, *shard_args(index)))
+            for future in pending:
+                finished(future.result())
+    save_manifest(directory, manifest)
+    return manifest
+
+
+def load_dataset(directory):
+    """The shards listed in the manifest of directory, memory-mapped read-only"""
+    manifest = load_manifest(directory)
+    return [np.load(os.path.join(directory, shard["file"]), mmap_mode="r") for shard in manifest["shards"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate self-play training data")
+    parser.add_argument("--out", default="selfplay_data", help="dataset directory (resumed if it exists)")
+    parser.add_argument("--games", type=int, default=1000, help="total games the dataset should hold")
+    parser.add_argument("--depth", type=int, default=3, help="search depth of every move")
+    parser.add_argument("--epsilon", type=float, default=0.1, help="chance of a random move")
+    parser.add_argument("--random-plies", type=int, default=2, help="opening plies played at random")
+    parser.add_argument("--games-per-shard", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows", type=int, default=6)
+    parser.add_argument("--columns", type=int, default=7)
+    parser.add_argument("--inarow", type=int, default=4)
+    args = parser.parse_args()
+    config = types.SimpleNamespace(rows=args.rows, columns=args.columns, inarow=args.inarow)
+    manifest = generate(args.out, args.games, config, args.depth, args.epsilon, args.random_plies,
+                        args.games_per_shard, args.workers, args.seed, verbose=True)
+    print("%d positions in %d shards" % (sum(shard["records"] for shard in manifest["shards"]), len(manifest["shards"])))
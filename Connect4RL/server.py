@@ -0,0 +1,509 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import engine
+from bitboard import Position
+from search import Searcher
+from stats import percentiles
+from threats import ThreatAnalyzer
+from transposition import TranspositionTable
+
+
+HOST = "127.0.0.1"
+PORT = 8765
+SERVER_WORKERS = os.cpu_count() or 1   # Worker processes that run the searches
+MAX_PENDING = 256   # Requests the queue holds; further requests wait for room (backpressure)
+MAX_INFLIGHT = 32   # Unanswered requests of one connection before it stops being read
+BATCH_SIZE = 16   # Most requests taken from the queue for one round of worker calls
+BATCH_WAIT = 0.002   # Seconds a round waits for more requests to fill its batch
+CACHE_SIZE = 100000   # Fixed-depth results kept for positions that come up again in any game
+DEADLINE = 10.0   # Seconds from arrival to answer a request that sets no deadline
+MAX_DEPTH = 6   # Deepest fixed-depth request; its full-tree search holds about 7**depth boards at once
+LATENCY_WINDOW = 10000   # Latest request latencies the metrics are computed over
+
+DEFAULT_CONFIG = {"rows": 6, "columns": 7, "inarow": 4}
+
+
+# Protocol: one JSON object per line in each direction. A move request is
+#   {"id": any, "board": [...], "mark": 1 or 2, "config": {"rows", "columns", "inarow"},
+#    "depth": plies, "budget": seconds, "deadline": seconds}
+# where everything but board and mark is optional. Without a budget the position is searched
+# to depth (default engine.N_STEPS, at most MAX_DEPTH) with plain minimax values, batched with other requests and
+# cached; with a budget it gets an anytime alpha-beta search of that many seconds, where only
+# the best scores are exact. The answer is
+#   {"id", "move", "scores": [score or null per column], "depth", "source", "latency_ms"}
+# with source "forced" (a win or a block, no search), "cache" or "search", or {"id", "error"}.
+# {"op": "metrics"} and {"op": "ping"} return the server metrics and {"ok": true}.
+
+
+# Helper function for the worker functions: a config object from (rows, columns, inarow)
+def shape_config(shape):
+    rows, columns, inarow = shape
+    return types.SimpleNamespace(rows=rows, columns=columns, inarow=inarow)
+
+
+# Helper function for AgentServer.move: the board or its left-right mirror, whichever is smaller,
+# and whether it is the mirror. A position and its mirror have mirrored scores, so they share
+# one cache entry and one search.
+def canonical_board(board, shape):
+    rows, columns, _ = shape
+    mirrored = tuple(board[row * columns + columns - 1 - col] for row in range(rows) for col in range(columns))
+    return (mirrored, True) if mirrored < board else (board, False)
+
+
+# Transposition table of the current worker process. It is never cleared between games:
+# its entries are exact for their depth whatever game the position came from.
+worker_table = {"tt": None, "shape": None}
+
+
+# Runs in a worker process: scores of the fixed-depth positions of one batch, all searched
+# together so that their leaves are evaluated in shared batches
+def search_batch(shape, depth, boards, marks):
+    config = shape_config(shape)
+    return engine.batch_move_scores(np.array(boards), marks, config, depth)
+
+
+# Runs in a worker process: anytime alpha-beta search of one position on the worker's table
+def search_timed(shape, board, mark, budget, max_depth):
+    config = shape_config(shape)
+    if worker_table["tt"] is None or worker_table["shape"] != shape:
+        worker_table["tt"] = TranspositionTable(engine.TT_MEGABYTES, engine.TT_POLICY)
+        worker_table["shape"] = shape
+    tt = worker_table["tt"]
+    tt.new_search()
+    position = Position.from_board(board, config, incremental=True)
+    searcher = Searcher(mark, config, tt, engine.THREATS, engine.THREAT_EXTENSION)
+    return searcher.iterative_deepening(position, budget, max_depth)
+
+
+# One parsed move request waiting in the queue; future gets its answer
+Job = collections.namedtuple("Job", ["board", "mark", "shape", "depth", "budget", "arrival", "deadline", "future"])
+
+
+# Helper function for the dispatcher: gives a job's future its result, or error if not None,
+# unless the future is already done (cancelled when the client disconnected)
+def resolve(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ServerMetrics:
+    """Counters and latencies of an AgentServer, reported by snapshot()."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.completed = 0
+        self.errors = 0
+        self.expired = 0  # requests dropped because their deadline passed in the queue
+        self.late = 0  # requests answered after their deadline
+        self.forced = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.batched = 0  # requests searched in batches, for the mean batch size
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def snapshot(self, queued=0):
+        uptime = time.perf_counter() - self.started
+        return {
+            "uptime": uptime,
+            "received": self.received,
+            "completed": self.completed,
+            "errors": self.errors,
+            "expired": self.expired,
+            "late": self.late,
+            "forced": self.forced,
+            "cache_hits": self.cache_hits,
+            "batches": self.batches,
+            "mean_batch": self.batched / self.batches if self.batches else 0.0,
+            "queued": queued,
+            "throughput": self.completed / uptime if uptime > 0 else 0.0,
+            "latency_ms": percentiles(self.latencies) if self.latencies else None,
+        }
+
+
+class AgentServer:
+    """Answers move requests of many games over one asyncio socket server.
+
+    Requests go into one bounded queue. A dispatcher task per worker process takes up
+    to BATCH_SIZE of them at a time: fixed-depth requests of the same board size and
+    depth are searched together in one worker call, so their leaves share numpy batches,
+    and requests with a time budget get one alpha-beta call each on the worker's
+    transposition table. Fixed-depth results are cached across games (a position and
+    its mirror share one entry, with the scores mirrored back), and forced moves are
+    answered by the threat analysis without reaching a worker.
+
+    Requests wait for room in the bounded queue, and a connection is not read while it
+    has MAX_INFLIGHT unanswered requests, so fast clients are slowed down instead of
+    growing the server's memory. A request still queued at its deadline is
+    answered with an error instead of being searched.
+    """
+
+    def __init__(self, workers=SERVER_WORKERS, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT,
+                 max_pending=MAX_PENDING, cache_size=CACHE_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # (shape, depth, board, mark) -> scores
+        self.analyzers = {}  # shape -> ThreatAnalyzer
+        self.metrics = ServerMetrics()
+        self.queue = None
+        self.pool = None
+        self.server = None
+        self.dispatchers = []
+        self.connections = {}  # handler task -> writer of every open connection
+
+    async def start(self, host=HOST, port=PORT, path=None):
+        """Listens on the Unix socket path if given, otherwise on host:port"""
+        self.queue = asyncio.Queue(self.max_pending)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        self.server.close()
+        # closed connections read as ended, so their handlers finish on their own
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        await self.server.wait_closed()
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        inflight = asyncio.Semaphore(MAX_INFLIGHT)
+        tasks = set()
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                await inflight.acquire()
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.respond(line, writer, inflight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            self.connections.pop(asyncio.current_task(), None)
+
+    # Helper function for handle_connection: answers one request line
+    async def respond(self, line, writer, inflight):
+        try:
+            answer = await self.answer(line)
+            writer.write(json.dumps(answer).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            inflight.release()
+
+    # Helper function for respond: the answer to one request line as a dict
+    async def answer(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("op") == "metrics":
+                return dict(self.metrics.snapshot(self.queue.qsize()), id=request_id)
+            if request.get("op") == "ping":
+                return {"id": request_id, "ok": True}
+            self.metrics.received += 1
+            answer = await self.move(request)
+        except KeyError as error:
+            self.metrics.errors += 1
+            return {"id": request_id, "error": "missing field %s" % error}
+        except (ValueError, TypeError) as error:
+            self.metrics.errors += 1
+            return {"id": request_id, "error": str(error)}
+        except TimeoutError as error:
+            self.metrics.expired += 1
+            return {"id": request_id, "error": str(error)}
+        answer["id"] = request_id
+        return answer
+
+    # Helper function for answer: validates a move request and gets its scores from the threat
+    # analysis, the cache or a worker
+    async def move(self, request):
+        arrival = time.perf_counter()
+        config = dict(DEFAULT_CONFIG, **request.get("config", {}))
+        shape = (int(config["rows"]), int(config["columns"]), int(config["inarow"]))
+        board = tuple(int(cell) for cell in request["board"])
+        mark = int(request["mark"])
+        if len(board) != shape[0] * shape[1] or mark not in (1, 2) or any(cell not in (0, 1, 2) for cell in board):
+            raise ValueError("board must hold rows*columns cells of 0, 1 or 2 and mark must be 1 or 2")
+        position = Position.from_board(board, shape_config(shape))
+        if position.is_terminal():
+            raise ValueError("the game is already over")
+        budget = request.get("budget")
+        budget = None if budget is None else float(budget)
+        if budget is not None and not 0 <= budget < float("inf"):
+            raise ValueError("budget must be a finite number of seconds, not below 0")
+        # a budget search deepens until its time is up unless a depth caps it; it is pruned, so
+        # its cap only has to fit the board, while fixed depths search the full tree
+        depth = request.get("depth", engine.N_STEPS if budget is None else None)
+        depth = None if depth is None else int(depth)
+        max_depth = MAX_DEPTH if budget is None else shape[0] * shape[1]
+        if depth is not None and not 1 <= depth <= max_depth:
+            raise ValueError("depth must be between 1 and %d" % max_depth)
+        timeout = float(request.get("deadline", DEADLINE))
+        if not 0 <= timeout < float("inf"):
+            raise ValueError("deadline must be a finite number of seconds, not below 0")
+        deadline = arrival + timeout
+
+        source = "search"
+        scores = None
+        move = None
+        if engine.THREATS:
+            if shape not in self.analyzers:
+                self.analyzers[shape] = ThreatAnalyzer(shape_config(shape))
+            move = self.analyzers[shape].forced_move(position, mark)
+            if move is not None:
+                source, depth = "forced", 0
+                self.metrics.forced += 1
+        canonical, mirrored = canonical_board(board, shape)
+        key = (shape, depth, canonical, mark)
+        if move is None and budget is None and key in self.cache:
+            self.cache.move_to_end(key)
+            scores = self.cache[key]
+            source = "cache"
+            self.metrics.cache_hits += 1
+        if move is None and scores is None:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put(Job(canonical, mark, shape, depth, budget, arrival, deadline, future))
+            scores, depth = await future
+        if scores is not None and mirrored:
+            scores = {shape[1] - 1 - col: score for col, score in scores.items()}
+        if move is None:
+            best = max(scores.values())
+            move = random.choice([col for col in sorted(scores) if scores[col] == best])
+        now = time.perf_counter()
+        self.metrics.completed += 1
+        self.metrics.late += now > deadline
+        self.metrics.latencies.append((now - arrival) * 1e3)
+        return {
+            "move": move,
+            "scores": None if scores is None else [scores.get(col) for col in range(shape[1])],
+            "depth": depth,
+            "source": source,
+            "latency_ms": (now - arrival) * 1e3,
+        }
+
+    # Runs as one task per worker: takes batches of jobs from the queue and runs them on the pool
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.queue.get()]
+            end = loop.time() + self.batch_wait
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    if loop.time() >= end:
+                        break
+                    try:
+                        jobs.append(await asyncio.wait_for(self.queue.get(), end - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+            now = time.perf_counter()
+            live = []
+            for job in jobs:
+                if job.future.done():
+                    continue  # the client has gone
+                if now >= job.deadline:
+                    resolve(job.future, error=TimeoutError("deadline passed before the search started"))
+                else:
+                    live.append(job)
+            calls = []
+            groups = collections.defaultdict(list)
+            for job in live:
+                if job.budget is None:
+                    groups[(job.shape, job.depth)].append(job)
+                else:
+                    # the search may use the budget, but no more than is left before the deadline
+                    budget = max(0.0, min(job.budget, job.deadline - now))
+                    calls.append(self.run_timed(job, budget))
+            for (shape, depth), group in groups.items():
+                calls.append(self.run_batch(shape, depth, group))
+            await asyncio.gather(*calls)
+
+    # Helper function for dispatch: searches the fixed-depth jobs of one shape and depth in one
+    # worker call; a position asked for by several games is searched once
+    async def run_batch(self, shape, depth, jobs):
+        positions = list(dict.fromkeys((job.board, job.mark) for job in jobs))
+        self.metrics.batches += 1
+        self.metrics.batched += len(positions)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.pool, search_batch, shape, depth, [board for board, _ in positions], [mark for _, mark in positions])
+        except Exception as error:
+            for job in jobs:
+                resolve(job.future, error=ValueError("search failed: %s" % error))
+            return
+        found = dict(zip(positions, results))
+        for (board, mark), scores in found.items():
+            self.cache[(shape, depth, board, mark)] = scores
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        for job in jobs:
+            resolve(job.future, (found[(job.board, job.mark)], depth))
+
+    # Helper function for dispatch: runs one job with a time budget on the pool
+    async def run_timed(self, job, budget):
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.pool, search_timed, job.shape, job.board, job.mark, budget, job.depth)
+        except Exception as error:
+            resolve(job.future, error=ValueError("search failed: %s" % error))
+            return
+        resolve(job.future, result)
+
+
+# Helper function for load_generator: plays games on one connection until none are left, the
+# server moving for one side and a random player for the other, and adds the latencies of the
+# server's moves to latencies
+async def play_games(reader, writer, games, depth, budget, rng, latencies, results):
+    while games:
+        game = games.pop()
+        server_mark = game % 2 + 1
+        config = shape_config((6, 7, 4))
+        position = Position(config)
+        mark = 1
+        while not position.is_terminal():
+            if mark == server_mark:
+                request = {"id": game, "board": position.to_board(), "mark": mark}
+                if depth is not None:
+                    request["depth"] = depth
+                if budget is not None:
+                    request["budget"] = budget
+                start = time.perf_counter()
+                writer.write(json.dumps(request).encode() + b"\n")
+                await writer.drain()
+                answer = json.loads(await reader.readline())
+                latencies.append((time.perf_counter() - start) * 1e3)
+                if "error" in answer:
+                    results["errors"] += 1
+                    break
+                results[answer["source"]] += 1
+                col = answer["move"]
+            else:
+                col = rng.choice(position.valid_moves())
+            position.play(col, mark)
+            mark = mark % 2 + 1
+        if position.is_win(server_mark):
+            results["server_wins"] += 1
+        results["games"] += 1
+
+
+async def load_generator(games=100, concurrency=16, depth=None, budget=None, host=HOST, port=PORT,
+                         path=None, seed=0, verbose=True):
+    """
+    Plays `games` games against a running server over `concurrency` connections at once and
+    returns the client-side statistics together with the server's metrics.
+    """
+    rng = random.Random(seed)
+    todo = list(range(games))
+    latencies = []
+    results = collections.Counter()
+    connections = []
+    for _ in range(concurrency):
+        if path is not None:
+            connections.append(await asyncio.open_unix_connection(path))
+        else:
+            connections.append(await asyncio.open_connection(host, port))
+    start = time.perf_counter()
+    await asyncio.gather(*(play_games(reader, writer, todo, depth, budget, random.Random(rng.random()), latencies, results)
+                           for reader, writer in connections))
+    elapsed = time.perf_counter() - start
+    reader, writer = connections[0]
+    writer.write(b'{"op": "metrics"}\n')
+    await writer.drain()
+    server_metrics = json.loads(await reader.readline())
+    for reader, writer in connections:
+        writer.close()
+        await writer.wait_closed()
+    summary = {
+        "games": results["games"],
+        "requests": len(latencies),
+        "errors": results["errors"],
+        "server_wins": results["server_wins"],
+        "sources": {source: results[source] for source in ("search", "cache", "forced")},
+        "elapsed": elapsed,
+        "requests_per_sec": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": percentiles(latencies) if latencies else None,
+        "server": server_metrics,
+    }
+    if verbose:
+        print(json.dumps(summary, indent=1))
+    return summary
+
+
+async def serve(host=HOST, port=PORT, path=None, workers=SERVER_WORKERS):
+    server = AgentServer(workers)
+    await server.start(host, port, path)
+    print("serving on %s" % (path or "%s:%d" % (host, port)))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+# Helper function for the load command with --local: starts a server in this process, runs the
+# load generator against it and stops the server again
+async def local_load(args):
+    server = AgentServer(args.workers)
+    await server.start(args.host, args.port, args.unix)
+    try:
+        return await load_generator(args.games, args.concurrency, args.depth, args.budget,
+                                    args.host, args.port, args.unix, args.seed)
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connect Four agent server and its load generator")
+    parser.add_argument("command", choices=["serve", "load"])
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", default=None, help="Unix socket path instead of host and port")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--local", action="store_true", help="load: start a server in this process first")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16, help="load: games played at once")
+    parser.add_argument("--depth", type=int, default=None, help="load: search depth of the requests")
+    parser.add_argument("--budget", type=float, default=None, help="load: seconds per move instead of a fixed depth")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.command == "serve":
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers))
+    elif args.local:
+        asyncio.run(local_load(args))
+    else:
+        asyncio.run(load_generator(args.games, args.concurrency, args.depth, args.budget,
+                                   args.host, args.port, args.unix, args.seed))
@@ -0,0 +1,185 @@
+import collections
+
+from bitboard import winning_cells
+from search import center_order, mirror_reduced, mirror_scores
+from transposition import TranspositionTable, LOWER, UPPER
+
+
+# Game-theoretic result of a position for the side to move. score is the usual solver score:
+# positive when the side to move wins (higher = earlier win), negative when it loses, 0 for a
+# draw. distance is the number of plies until the winning line is completed (None for a draw).
+Solution = collections.namedtuple("Solution", ["value", "score", "distance", "move"])
+
+
+# Helper function for Solver: C-style integer division (rounds towards zero)
+def div2(value):
+    return -((-value) // 2) if value < 0 else value // 2
+
+
+class Solver:
+    """Exact win/draw/loss solver for small endgames.
+
+    Negamax with alpha-beta on the bitboards of a Position, driven by a null-window
+    search over the score range. The search only looks at moves that do not lose
+    immediately, plays forced blocks without branching and tries the moves that create
+    the most threats first. Bounds go into a TranspositionTable that is kept between
+    calls; keys do not depend on whose mark is searched, so it can be shared by both
+    players and across games. On a symmetric board only one column of each mirror
+    pair is solved at the root; the table keeps plain keys, since mirrored endgame
+    positions hardly ever meet and mirroring every key costs more than it saves.
+    """
+
+    def __init__(self, config, tt=None):
+        self.rows = config.rows
+        self.columns = config.columns
+        self.inarow = config.inarow
+        self.height = config.rows + 1
+        self.cells = config.rows * config.columns
+        self.bottom = sum(1 << (col * self.height) for col in range(config.columns))
+        self.board_mask = self.bottom * ((1 << config.rows) - 1)
+        self.column_masks = [((1 << config.rows) - 1) << (col * self.height) for col in range(config.columns)]
+        self.directions = (1, self.height, self.height + 1, self.height - 1)
+        self.order = center_order(config.columns)
+        self.tt = tt if tt is not None else TranspositionTable(32)
+        self.nodes = 0
+
+    # Empty cells where a piece of the player owning `own` would complete a line
+    def winning_cells(self, own, mask):
+        return winning_cells(own, mask, self.directions, self.inarow, self.board_mask)
+
+    def possible(self, mask):
+        return (mask + self.bottom) & self.board_mask
+
+    # Solves position for the side playing mark (normally the side to move)
+    def solve(self, position, mark):
+        current = position.masks[mark]
+        mask = position.masks[1] | position.masks[2]
+        moves = position.num_moves()
+        score = self.solve_masks(current, mask, moves)
+        return self.solution(score, moves, self.best_move(current, mask, moves, score))
+
+    # Exact score of every valid column for mark, as {col: score}; the score of a column is
+    # the solver score of the position after it, from mark's point of view
+    def move_scores(self, position, mark):
+        current = position.masks[mark]
+        mask = position.masks[1] | position.masks[2]
+        moves = position.num_moves()
+        scores = {}
+        for col in mirror_reduced(position, self.order):
+            move = self.possible(mask) & self.column_masks[col]
+            if not move:
+                continue
+            if self.winning_cells(current, mask) & move:
+                scores[col] = div2(self.cells + 1 - moves)
+            else:
+                scores[col] = -self.solve_masks(current ^ mask, mask | move, moves + 1)
+        return mirror_scores(position, scores)
+
+    def solution(self, score, moves, move):
+        if score > 0:
+            value = "win"
+            # the side to move completes its line on one of its own plies (odd distance)
+            distance = self.cells + 2 - 2*score - moves
+            distance -= 1 - distance % 2
+        elif score < 0:
+            value = "loss"
+            # the opponent completes its line on one of its plies (even distance)
+            distance = self.cells + 2 + 2*score - moves
+            distance -= distance % 2
+        else:
+            value, distance = "draw", None
+        return Solution(value, score, distance, move)
+
+    # Null-window search: narrows [min, max] with zero-width windows until the score is known
+    def solve_masks(self, current, mask, moves):
+        if self.winning_cells(current, mask) & self.possible(mask):
+            return div2(self.cells + 1 - moves)
+        low = -div2(self.cells - moves)
+        high = div2(self.cells + 1 - moves)
+        while low < high:
+            middle = low + div2(high - low)
+            if middle <= 0 and div2(low) < middle:
+                middle = div2(low)
+            elif middle >= 0 and div2(high) > middle:
+                middle = div2(high)
+            result = self.negamax(current, mask, moves, middle, middle + 1)
+            if result <= middle:
+                high = result
+            else:
+                low = result
+        return low
+
+    # Helper function for solve: a column reaching score (None if the game is already over)
+    def best_move(self, current, mask, moves, score):
+        wins = self.winning_cells(current, mask)
+        best = None
+        for col in self.order:
+            move = self.possible(mask) & self.column_masks[col]
+            if not move:
+                continue
+            if wins & move:
+                return col
+            child = -self.solve_masks(current ^ mask, mask | move, moves + 1)
+            if child == score:
+                return col
+            if best is None:
+                best = col
+        return best
+
+    # Negamax with alpha-beta; the side to move has not got an immediate win
+    def negamax(self, current, mask, moves, alpha, beta):
+        self.nodes += 1
+        possible = self.possible(mask)
+        opponent = current ^ mask
+        opponent_wins = self.winning_cells(opponent, mask)
+        forced = possible & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                return -div2(self.cells - moves)  # two threats to block at once
+            possible = forced
+        # never play directly under a cell where the opponent would win
+        possible &= ~(opponent_wins >> 1)
+        if not possible:
+            return -div2(self.cells - moves)
+        if moves >= self.cells - 2:
+            return 0
+        low = -div2(self.cells - 2 - moves)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+        high = div2(self.cells - 1 - moves)
+        key = current + mask + self.bottom
+        entry = self.tt.probe(key)
+        if entry is not None:
+            value, _, bound, _ = entry
+            if bound == UPPER and value < high:
+                high = value
+            elif bound == LOWER and value > alpha:
+                alpha = value
+                if alpha >= beta:
+                    return alpha
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+        for move in self.ordered_moves(current, mask, possible):
+            score = -self.negamax(opponent, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                self.tt.store(key, score, 0, LOWER, None)
+                return score
+            if score > alpha:
+                alpha = score
+        self.tt.store(key, alpha, 0, UPPER, None)
+        return alpha
+
+    # Helper function for negamax: moves that create the most new winning cells first, center first on ties
+    def ordered_moves(self, current, mask, possible):
+        keyed = []
+        for rank, col in enumerate(self.order):
+            move = possible & self.column_masks[col]
+            if move:
+                threats = (self.winning_cells(current | move, mask | move)).bit_count()
+                keyed.append((-threats, rank, move))
+        keyed.sort()
+        return [move for _, _, move in keyed]
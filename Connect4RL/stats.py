@@ -0,0 +1,102 @@
+import json
+import time
+
+import numpy as np
+
+from search import Searcher
+
+
+class SearchStats:
+    """Counters and timings of one engine.analyse call.
+
+    Only the alpha-beta searches fill in every field. The endgame solver gives nodes
+    and cache hits, and the full-tree and parallel searches only give depth and wall time.
+    """
+
+    def __init__(self, search):
+        self.search = search
+        self.nodes = 0
+        self.leaves = 0
+        self.terminal_checks = 0
+        self.cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.depth = None
+        self.wall_time = 0.0
+        self.heuristic_time = 0.0
+        self.movegen_time = 0.0
+        self.start_counts = None
+
+    # Counter values of engine (a Searcher or Solver) before it searches, see end()
+    def begin(self, engine):
+        tt = engine.tt
+        self.start_counts = (engine.nodes, tt.probes if tt else 0, tt.hits if tt else 0)
+
+    # Adds what engine counted since begin()
+    def end(self, engine):
+        nodes, probes, hits = self.start_counts
+        tt = engine.tt
+        self.nodes += engine.nodes - nodes
+        self.leaves += getattr(engine, "leaves", 0)
+        self.terminal_checks += getattr(engine, "terminal_checks", 0)
+        self.cutoffs += getattr(engine, "cutoffs", 0)
+        if tt is not None:
+            self.tt_probes += tt.probes - probes
+            self.tt_hits += tt.hits - hits
+
+    def record(self):
+        return {
+            "search": self.search,
+            "depth": self.depth,
+            "nodes": self.nodes,
+            "leaves": self.leaves,
+            "terminal_checks": self.terminal_checks,
+            "cutoffs": self.cutoffs,
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "wall_time": self.wall_time,
+            "heuristic_time": self.heuristic_time,
+            "movegen_time": self.movegen_time,
+            "nodes_per_sec": self.nodes / self.wall_time if self.wall_time else 0.0,
+        }
+
+
+class TimedSearcher(Searcher):
+    """Searcher that also adds the time of its leaf evaluations and move generation to stats.
+
+    It is only used when statistics are on, so the plain Searcher pays nothing for them.
+    """
+
+    def __init__(self, mark, config, tt=None, stats=None, threats=False, extension=4, model=None):
+        super().__init__(mark, config, tt, threats, extension, model)
+        self.stats = stats
+
+    def evaluate(self, position):
+        start = time.perf_counter()
+        value = super().evaluate(position)
+        self.stats.heuristic_time += time.perf_counter() - start
+        return value
+
+    def ordered_moves(self, position, player, ply, tt_move=None, candidates=None):
+        start = time.perf_counter()
+        moves = super().ordered_moves(position, player, ply, tt_move, candidates)
+        self.stats.movegen_time += time.perf_counter() - start
+        return moves
+
+
+# Appends one record as a line of JSON to path
+def log_stats(path, record, **extra):
+    with open(path, "a") as f:
+        f.write(json.dumps(dict(record, **extra)) + "\n")
+
+
+# Mean, median, tail percentiles and maximum of samples (latencies or timings)
+def percentiles(samples):
+    samples = np.asarray(samples)
+    return {
+        "mean": float(samples.mean()),
+        "p50": float(np.percentile(samples, 50)),
+        "p90": float(np.percentile(samples, 90)),
+        "p99": float(np.percentile(samples, 99)),
+        "max": float(samples.max()),
+    }
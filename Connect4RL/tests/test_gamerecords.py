@@ -0,0 +1,12 @@
+import types
+
+import gamerecords
+
+
+def test_wide_boards_do_not_collide_in_the_opening_index(tmp_path):
+    path = str(tmp_path / "games.c4r")
+    with gamerecords.GameWriter(path) as writer:
+        wide = writer.write([15, 1, 2], 0, ("a", "b"), types.SimpleNamespace(rows=4, columns=16, inarow=4))
+        standard = writer.write([0, 1, 2], 0, ("a", "b"), types.SimpleNamespace(rows=6, columns=7, inarow=4))
+    assert list(gamerecords.find_games(path, prefix=[0])) == [standard]
+    assert list(gamerecords.find_games(path)) == [wide, standard]
@@ -0,0 +1,21 @@
+import types
+
+import mcts
+from bitboard import Position
+
+
+CONFIG = types.SimpleNamespace(rows=6, columns=7, inarow=4)
+
+
+def test_agent_moves_without_a_budget_left():
+    obs = types.SimpleNamespace(board=[0] * 42, mark=1)
+    assert mcts.agent(obs, CONFIG, time_budget=0) in range(7)
+    assert mcts.agent(obs, CONFIG, iterations=0) in range(7)
+
+
+def test_best_move_of_an_unexpanded_root_is_the_most_central():
+    tree = mcts.MCTS(CONFIG, capacity=4)  # too small to expand the root
+    tree.set_root(Position(CONFIG), 1)
+    tree.search(10)
+    assert tree.root_visits() == {}
+    assert tree.best_move() == 3
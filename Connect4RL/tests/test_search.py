@@ -0,0 +1,62 @@
+import random
+import time
+import types
+
+import numpy as np
+
+from bitboard import Position
+from search import Searcher, SearchTimeout
+from transposition import TranspositionTable
+
+
+CONFIG = types.SimpleNamespace(rows=6, columns=7, inarow=4)
+
+
+# Helper function for the tests: seeded random positions that are still open, with the mark to move
+def random_positions(count, seed=0):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = Position(CONFIG, incremental=True)
+        mark = 1
+        for _ in range(rng.randrange(4, 24)):
+            position.play(rng.choice(position.valid_moves()), mark)
+            mark = mark % 2 + 1
+            if position.is_terminal():
+                break
+        if not position.is_terminal():
+            positions.append((position, mark))
+    return positions
+
+
+def test_threat_search_scores_mirror_images_alike():
+    for position, mark in random_positions(80):
+        mirror = Position.from_grid(position.to_grid()[:, ::-1], CONFIG, incremental=True)
+        scores = Searcher(mark, CONFIG, TranspositionTable(4), threats=True).root_scores(position, 4, exact=True)
+        mirror_scores = Searcher(mark, CONFIG, TranspositionTable(4), threats=True).root_scores(mirror, 4, exact=True)
+        assert scores == {CONFIG.columns - 1 - col: score for col, score in mirror_scores.items()}
+
+
+def test_threat_search_scores_finished_games_like_evaluate():
+    # the forcing-line extension must never play on after the game is over
+    rng = random.Random(1)
+    for position, mark in random_positions(40, seed=1):
+        while not position.is_terminal():
+            position.play(rng.choice(position.valid_moves()), mark)
+            mark = mark % 2 + 1
+        for side in (1, 2):
+            searcher = Searcher(side, CONFIG, threats=True)
+            for maximizing in (True, False):
+                assert searcher.alphabeta(position, 0, -np.inf, np.inf, maximizing, 0) == searcher.evaluate(position)
+
+
+def test_interrupt_before_the_deadline_is_set_stops_iterative_deepening():
+    position, mark = random_positions(1)[0]
+    searcher = Searcher(mark, CONFIG, TranspositionTable(4), threats=True)
+    searcher.deadline = 0  # what engine.interrupt does while depth 1 is searched
+    start = time.perf_counter()
+    try:
+        _, depth = searcher.iterative_deepening(position, 5.0)
+    except SearchTimeout:
+        depth = 1
+    assert depth == 1 and time.perf_counter() - start < 1.0
@@ -0,0 +1,25 @@
+import asyncio
+
+import server
+
+
+def test_cancelled_request_does_not_stop_the_server():
+    async def run():
+        agent_server = server.AgentServer(workers=1)
+        await agent_server.start(port=0)
+        try:
+            board = [0] * 42
+            searching = asyncio.create_task(agent_server.move({"board": board, "mark": 1, "budget": 0.5}))
+            await asyncio.sleep(0.2)
+            searching.cancel()  # what handle_connection does when the client disconnects
+            queued = asyncio.create_task(agent_server.move({"board": board, "mark": 1, "budget": 0.5}))
+            await asyncio.sleep(0)
+            queued.cancel()
+            board[38] = 1
+            answer = await asyncio.wait_for(agent_server.move({"board": board, "mark": 2, "budget": 0.05}), 10)
+            assert answer["source"] == "search" and 0 <= answer["move"] < 7
+            assert not any(task.done() for task in agent_server.dispatchers)
+        finally:
+            await agent_server.close()
+
+    asyncio.run(run())
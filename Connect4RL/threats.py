@@ -0,0 +1,118 @@
+from bitboard import board_tables, winning_cells
+from search import center_order
+
+
+ZUGZWANG_SCORE = 500   # Leaf bonus of the threat search for the player Zugzwang favours (an open three is 1, a three of the opponent -100)
+
+
+class ThreatAnalyzer:
+    """Winning cells of both players of a Position and the moves they force.
+
+    A winning cell is an empty cell that completes a line for its owner. Cells that can
+    be played at once decide the next move: the player to move takes a win, otherwise
+    blocks the opponent's single playable cell, and is lost against two of them. Cells
+    higher up work through Zugzwang: when the board fills up, the first player (mark 1)
+    gets the odd rows and the second player the even rows, so an odd threat is worth
+    more to mark 1 and an even threat to mark 2. A move directly under an opponent's
+    winning cell hands them that cell and is never worth searching unless nothing else
+    is left.
+    """
+
+    def __init__(self, config):
+        self.rows = config.rows
+        self.inarow = config.inarow
+        (self.directions, _, self.bottom,
+         self.column_masks, self.board_mask) = board_tables(config.rows, config.columns, config.inarow)
+        self.order = center_order(config.columns)
+        # rows counted from the bottom row 1: bit 0 of every column is row 1, so the odd rows are the even bits
+        self.odd_rows = sum(self.bottom << row for row in range(0, config.rows, 2))
+        self.even_rows = self.board_mask & ~self.odd_rows
+
+    # False when mark has no winning cell for sure: with an IncrementalEvaluator, no window
+    # holds inarow-1 pieces of mark and none of the opponent's (checked in O(1))
+    def may_threaten(self, position, mark):
+        return position.evaluator is None or position.evaluator.counts[mark][self.inarow - 1] > 0
+
+    # Winning cells of mark that can be played right now
+    def playable_wins(self, position, mark):
+        if not self.may_threaten(position, mark):
+            return 0
+        mask = position.masks[1] | position.masks[2]
+        cells = winning_cells(position.masks[mark], mask, self.directions, self.inarow, self.board_mask)
+        return cells & (mask + self.bottom)
+
+    # Helper function for the threat lookups: the columns of the cells in bits, center first
+    def columns_of(self, bits):
+        return [col for col in self.order if bits & self.column_masks[col]]
+
+    # The move that has to be played by mark, or None if there is a choice: a win, the only
+    # block of the opponent's single playable threat, or the only column left. Against two
+    # or more playable threats every move loses and there is nothing to choose either, so
+    # the most central block is returned.
+    def forced_move(self, position, mark):
+        wins = self.playable_wins(position, mark)
+        if wins:
+            return self.columns_of(wins)[0]
+        blocks = self.playable_wins(position, mark % 2 + 1)
+        if blocks:
+            return self.columns_of(blocks)[0]
+        valid = position.valid_moves()
+        return valid[0] if len(valid) == 1 else None
+
+    # Moves of mark along a forcing line: the wins or, failing that, the blocks; empty when
+    # the position is quiet. All of them are returned, never the first by column order, so
+    # that a position and its mirror image follow the same lines.
+    def forcing_moves(self, position, mark):
+        wins = self.playable_wins(position, mark)
+        if wins:
+            return self.columns_of(wins)
+        blocks = self.playable_wins(position, mark % 2 + 1)
+        return self.columns_of(blocks)
+
+    # moves (a list of columns) reduced to the ones worth searching for mark: only the wins if
+    # there are any, only the blocks against playable threats, and otherwise no move that
+    # drops a piece directly under an opponent's winning cell (unless all of them do). Like
+    # forcing_moves, it never picks one of equal moves by column, so the result is mirror-symmetric.
+    def prune_moves(self, position, mark, moves):
+        wins = self.playable_wins(position, mark)
+        if wins:
+            return [col for col in moves if wins & self.column_masks[col]]
+        opponent = mark % 2 + 1
+        if not self.may_threaten(position, opponent):
+            return moves
+        mask = position.masks[1] | position.masks[2]
+        playable = (mask + self.bottom) & self.board_mask
+        opponent_cells = winning_cells(position.masks[opponent], mask, self.directions, self.inarow, self.board_mask)
+        blocks = opponent_cells & playable
+        if blocks:
+            return [col for col in moves if blocks & self.column_masks[col]]
+        # a cell is under a winning cell when the winning cell is one bit above it
+        unsafe = (opponent_cells >> 1) & playable
+        safe = [col for col in moves if not unsafe & self.column_masks[col]]
+        return safe or moves
+
+    # The player Zugzwang favours when the board fills up without anyone giving way: mark 1
+    # with an odd threat that mark 2 has no even threat under, mark 2 with an even threat
+    # while mark 1 has no odd threat, otherwise 0
+    def zugzwang(self, position):
+        mask = position.masks[1] | position.masks[2]
+        odd = even = 0
+        if self.may_threaten(position, 1):
+            odd = winning_cells(position.masks[1], mask, self.directions, self.inarow, self.board_mask) & self.odd_rows
+        if self.may_threaten(position, 2):
+            even = winning_cells(position.masks[2], mask, self.directions, self.inarow, self.board_mask) & self.even_rows
+        if not odd:
+            return 2 if even else 0
+        # cells above an even threat in its column (the spare bit on top of each column stops
+        # the spread); the lowest odd threat of a column is free when it is not one of them
+        above = (even << 1) & self.board_mask
+        for _ in range(self.rows - 2):
+            above |= (above << 1) & self.board_mask
+        return 1 if odd & ~above else 0
+
+    # ZUGZWANG_SCORE for mark if Zugzwang favours it, minus that if it favours the opponent
+    def parity_score(self, position, mark):
+        favoured = self.zugzwang(position)
+        if not favoured:
+            return 0
+        return ZUGZWANG_SCORE if favoured == mark else -ZUGZWANG_SCORE
@@ -0,0 +1,197 @@
+import collections
+import math
+import os
+import random
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bitboard import Position
+
+
+DEFAULT_CONFIG = types.SimpleNamespace(rows=6, columns=7, inarow=4)
+
+# One finished game. winner is 1 or 2 (0 for a draw); loser_fault is "invalid", "timeout" or "error"
+# when the loser lost by an illegal move, by going over its time limit or by raising an exception;
+# times are seconds per move.
+GameResult = collections.namedtuple("GameResult", ["first", "winner", "moves", "times", "loser_fault"])
+
+
+def random_agent(obs, config):
+    return random.choice([c for c in range(config.columns) if obs.board[c] == 0])
+
+
+# Helper function for play_match: "random" names the built-in random agent, like in kaggle
+def resolve_agent(agent):
+    return random_agent if agent == "random" else agent
+
+
+# Helper function for play_match: time_limit as {player: seconds or None}, from one limit for
+# both agents or a (agent1, agent2) pair
+def time_limits(time_limit):
+    if isinstance(time_limit, (tuple, list)):
+        return {1: time_limit[0], 2: time_limit[1]}
+    return {1: time_limit, 2: time_limit}
+
+
+def play_match(agent1, agent2, config=DEFAULT_CONFIG, seed=None, time_limit=None):
+    """
+    Plays one game with agent1 as player 1 and agent2 as player 2 on the project's own rules.
+
+    Args:
+        agent1, agent2: agent functions (obs, config) -> column, or "random".
+        config: board size (rows, columns, inarow).
+        seed: seeds random and numpy before the game, so random agents are reproducible.
+        time_limit: seconds allowed per move, or a (agent1, agent2) pair of them (None for
+            no limit); a slower move loses the game.
+
+    An agent that raises loses the game with loser_fault "error".
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+    agents = {1: resolve_agent(agent1), 2: resolve_agent(agent2)}
+    limits = time_limits(time_limit)
+    position = Position(config)
+    board = [0] * (config.rows * config.columns)
+    moves, times = [], []
+    mark = 1
+    while True:
+        obs = types.SimpleNamespace(board=list(board), mark=mark)
+        start = time.perf_counter()
+        try:
+            col = agents[mark](obs, config)
+        except Exception:
+            times.append(time.perf_counter() - start)
+            return GameResult(1, mark%2+1, moves, times, "error")
+        times.append(time.perf_counter() - start)
+        if limits[mark] is not None and times[-1] > limits[mark]:
+            return GameResult(1, mark%2+1, moves, times, "timeout")
+        if not isinstance(col, (int, np.integer)) or not 0 <= col < config.columns or not position.can_play(col):
+            return GameResult(1, mark%2+1, moves, times, "invalid")
+        col = int(col)
+        board[(config.rows - 1 - position.heights[col]) * config.columns + col] = mark
+        position.play(col, mark)
+        moves.append(col)
+        if position.is_win(mark):
+            return GameResult(1, mark, moves, times, None)
+        if position.is_full():
+            return GameResult(1, 0, moves, times, None)
+        mark = mark%2+1
+
+
+# Runs in a worker process: a chunk of games as (game index, result) with results from
+# agent1's point of view (first is the player number agent1 had)
+def play_games(agent1, agent2, config, games, seed, time_limit):
+    limits = time_limits(time_limit)
+    results = []
+    for game in games:
+        if game % 2 == 0:
+            result = play_match(agent1, agent2, config, seed + game, (limits[1], limits[2]))
+        else:
+            result = play_match(agent2, agent1, config, seed + game, (limits[2], limits[1]))._replace(first=2)
+        results.append((game, result))
+    return results
+
+
+# Helper function for summarize: Wilson score interval for successes out of n
+def wilson_interval(successes, n, z=1.96):
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    center = (p + z*z/(2*n)) / (1 + z*z/n)
+    margin = z * math.sqrt(p*(1-p)/n + z*z/(4*n*n)) / (1 + z*z/n)
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+# Helper function for summarize: games each agent lost by fault ("invalid", "timeout" or "error")
+def fault_counts(results, fault):
+    return {side: sum(1 for r in results if r.loser_fault == fault and r.winner == (r.first if side == "agent2" else 3 - r.first))
+            for side in ("agent1", "agent2")}
+
+
+# Helper function for summarize: Elo difference for an expected score, clamped away from 0 and 1
+def elo_difference(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1/score - 1)
+
+
+def summarize(results, z=1.96):
+    """Win/draw/loss rates of agent1 with confidence intervals and the Elo difference to agent2"""
+    n = len(results)
+    wins = sum(1 for r in results if r.winner == r.first)
+    losses = sum(1 for r in results if r.winner not in (0, r.first))
+    draws = n - wins - losses
+    points = [1.0 if r.winner == r.first else 0.0 if r.winner else 0.5 for r in results]
+    score = sum(points) / n if n else 0.5
+    stderr = (np.std(points) / math.sqrt(n)) if n > 1 else 0.5
+    times = [t for r in results for t in r.times]
+    return {
+        "games": n,
+        "wins": wins,
+        "draws": draws,
+        "losses": losses,
+        "win_rate": wins / n if n else 0.0,
+        "win_rate_ci": wilson_interval(wins, n, z),
+        "draw_rate": draws / n if n else 0.0,
+        "draw_rate_ci": wilson_interval(draws, n, z),
+        "loss_rate": losses / n if n else 0.0,
+        "loss_rate_ci": wilson_interval(losses, n, z),
+        "score": score,
+        "elo": elo_difference(score),
+        "elo_ci": (elo_difference(score - z*stderr), elo_difference(score + z*stderr)),
+        "invalid": fault_counts(results, "invalid"),
+        "timeouts": fault_counts(results, "timeout"),
+        "errors": fault_counts(results, "error"),
+        "mean_move_time": float(np.mean(times)) if times else 0.0,
+    }
+
+
+def run_tournament(agent1, agent2, n_games=100, config=DEFAULT_CONFIG, workers=None, seed=0,
+                   time_limit=None, chunk_size=10, return_games=False, record_path=None, names=None):
+    """
+    Plays n_games between agent1 and agent2 across a process pool, alternating who moves
+    first, and returns the summary of agent1's results (plus the games if return_games).
+
+    Agents must be picklable (module-level functions or "random"). workers=1 plays in
+    this process; game i is seeded with seed + i, so results do not depend on workers.
+    time_limit is one per-move limit for both agents or an (agent1, agent2) pair.
+    With record_path, every game is appended to that gamerecords store, under names (a pair,
+    by default gamerecords.agent_name of each agent).
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = [range(start, min(start + chunk_size, n_games)) for start in range(0, n_games, chunk_size)]
+    if workers == 1:
+        pairs = [pair for chunk in chunks for pair in play_games(agent1, agent2, config, chunk, seed, time_limit)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(play_games, agent1, agent2, config, chunk, seed, time_limit) for chunk in chunks]
+            pairs = [pair for future in futures for pair in future.result()]
+    results = [result for _, result in sorted(pairs, key=lambda pair: pair[0])]
+    if record_path is not None:
+        record_games(results, agent1, agent2, config, record_path, names)
+    summary = summarize(results)
+    return (summary, results) if return_games else summary
+
+
+# Helper function for run_tournament: appends the games to a game record store
+def record_games(results, agent1, agent2, config, path, names=None):
+    from gamerecords import GameWriter, agent_name
+
+    names = tuple(names) if names is not None else (agent_name(agent1), agent_name(agent2))
+    with GameWriter(path) as writer:
+        for result in results:
+            agents = names if result.first == 1 else names[::-1]
+            writer.write(result.moves, result.winner, agents, config, result.times)
+
+
+def print_report(summary):
+    print("Games:", summary["games"])
+    for name in ("win", "draw", "loss"):
+        low, high = summary[name + "_rate_ci"]
+        print("Agent 1 %s rate: %.3f (95%% CI %.3f-%.3f)" % (name, summary[name + "_rate"], low, high))
+    low, high = summary["elo_ci"]
+    print("Elo difference: %+.0f (95%% CI %+.0f to %+.0f)" % (summary["elo"], low, high))
+    print("Invalid plays:", summary["invalid"], "Timeouts:", summary["timeouts"], "Errors:", summary["errors"])
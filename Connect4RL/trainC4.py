@@ -1,189 +1,55 @@
+import time
 
 import numpy as np
-import random
-
-
-# calculates score if agent drops piece in selected column
-def score_move(grid, col, mark, config):
-    next_grid = drop_piece(grid, col, mark, config)
-    score = get_heuristic(next_grid, mark, config)
-    return score
-
-
-
-# helper function for score move - gets board at next step if agent drops piece in selected column
-def drop_piece(grid, col, mark, config):
-    next_grid = grid.copy()
-    for row in range(config.rows - 1, -1, -1):
-        if next_grid[row][col] == 0:
-            break
-    next_grid[row][col] = mark
-    return next_grid
-
-
-# # Helper fnction for score move - gets heuristic score of the grid
-# def get_heuristic(grid, mark, config):
-#     num_threes = count_windows(grid, mark, 3, config)
-#     num_fours = count_windows(grid, 4, mark, config)
-#     num_threes_opp = count_windows(grid, 3, mark%2+1, config)
-#     score = num_threes - 1e2*num_threes_opp + 1e6*num_fours
-#     return score
-
-
-# Helper function for minimax: calculates value of heuristic for grid
-def get_heuristic(grid, mark, config):
-    num_threes = count_windows(grid, 3, mark, config)
-    num_fours = count_windows(grid, 4, mark, config)
-    num_twos_opp = count_windows(grid, 2, mark%2+1, config)
-    num_threes_opp = count_windows(grid, 3, mark%2+1, config)
-    num_fours_opp = count_windows(grid, 4, mark%2+1, config)
-    score = num_threes - 1e1*num_twos_opp - 1e2*num_threes_opp - 1e4*num_fours_opp + 1e6*num_fours
-    return score
-
-
-# Uses minimax to calculate value of dropping piece in selected column
-def score_move(grid, col, mark, config, nsteps):
-    next_grid = drop_piece(grid, col, mark, config)
-    score = minimax(next_grid, nsteps-1, False, mark, config)
-    return score
-
-
-# Helper function for minimax: checks if agent or opponent has four in a row in the window
-def is_terminal_window(window, config):
-    return window.count(1) == config.inarow or window.count(2) == config.inarow
-
-
-# Helper function for minimax: checks if game has ended
-def is_terminal_node(grid, config):
-    # Check for draw 
-    if list(grid[0, :]).count(0) == 0:
-        return True
-    # Check for win: horizontal, vertical, or diagonal
-    # horizontal 
-    for row in range(config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[row, col:col+config.inarow])
-            if is_terminal_window(window, config):
-                return True
-    # vertical
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns):
-            window = list(grid[row:row+config.inarow, col])
-            if is_terminal_window(window, config):
-                return True
-    # positive diagonala
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row+config.inarow), range(col, col+config.inarow)])
-            if is_terminal_window(window, config):
-                return True
-    # negative diagonal
-    for row in range(config.inarow-1, config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row-config.inarow, -1), range(col, col+config.inarow)])
-            if is_terminal_window(window, config):
-                return True
-    return False
-
-
-# Minimax implementation
-def minimax(node, depth, maximizingPlayer, mark, config):
-    is_terminal = is_terminal_node(node, config)
-    valid_moves = [c for c in range(config.columns) if node[0][c] == 0]
-    if depth == 0 or is_terminal:
-        return get_heuristic(node, mark, config)
-    if maximizingPlayer:
-        value = -np.Inf
-        for col in valid_moves:
-            child = drop_piece(node, col, mark, config)
-            value = max(value, minimax(child, depth-1, False, mark, config))
-        return value
-    else:
-        value = np.Inf
-        for col in valid_moves:
-            child = drop_piece(node, col, mark%2+1, config)
-            value = min(value, minimax(child, depth-1, True, mark, config))
-        return value
-
-
-# Helper function for get_heuristic: checks if window satisfies heuristic conditions
-def check_window(window, num_discs, piece, config):
-    return (window.count(piece) == num_discs and window.count(0) == config.inarow-num_discs)
-
-
-# Helper function for get_heuristic: counts number of windows satisfying specified heuristic conditions
-def count_windows(grid, num_discs, piece, config):
-    num_windows = 0
-    # horizontal
-    for row in range(config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[row, col:col+config.inarow])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    # vertical
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns):
-            window = list(grid[row:row+config.inarow, col])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    # positive diagonal
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row+config.inarow), range(col, col+config.inarow)])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    # negative diagonal
-    for row in range(config.inarow-1, config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row-config.inarow, -1), range(col, col+config.inarow)])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    return num_windows
-
-
-N_STEPS = 4   # Number of steps for minimax search
-
-def agent(obs, config):
-    # Get list of valid moves
-    valid_moves = [c for c in range(config.columns) if obs.board[c] == 0]
-    # Convert the board to a 2D grid
-    grid = np.asarray(obs.board).reshape(config.rows, config.columns)
-    # Use the heuristic to assign a score to each possible board in the next step
-    scores = dict(zip(valid_moves, [score_move(grid, col, obs.mark, config, N_STEPS) for col in valid_moves]))
-    # Get a list of columns (moves) that maximize the heuristic
-    max_cols = [key for key in scores.keys() if scores[key] == max(scores.values())]
-    # Select at random from the maximizing columns
-    return random.choice(max_cols)
-
-
-from kaggle_environments import make, evaluate
-
-env = make("connectx", debug=True)
-
-env.run([agent, "random"])
-
-env.render(mode="ipython")
-
-
-
-def get_win_percentages(agent1, agent2, n_rounds=100):
+
+# The engine (rules, heuristic, search, agent) lives in engine.py and does no work on import;
+# this module keeps the notebook entry points: the kaggle demo game, win percentages
+# against another agent and a game in the terminal
+from engine import agent, analyse, count_windows, drop_piece, get_heuristic, is_terminal_node, minimax, score_move
+from gamerecords import RECORDS_PATH, agent_name, kaggle_game, record_game
+
+
+# Plays one game against kaggle's random agent and renders it (needs kaggle_environments)
+def run_kaggle_demo(record_path=RECORDS_PATH):
+    from kaggle_environments import make
+
+    env = make("connectx", debug=True)
+
+    env.run([agent, "random"])
+
+    moves, winner = kaggle_game(env.steps, env.configuration.columns)
+    record_game(moves, winner, (agent_name(agent), "random"), env.configuration, path=record_path)
+
+    return env.render(mode="ipython")
+
+
+
+def get_win_percentages(agent1, agent2, n_rounds=100, workers=None, seed=0, time_limit=None, record_path=None):
+    from tournament import DEFAULT_CONFIG, run_tournament
+
     # Use default Connect Four setup
-    config = {'rows': 6, 'columns': 7, 'inarow': 4}
-    # Agent 1 goes first (roughly) half the time          
-    outcomes = evaluate("connectx", [agent1, agent2], config, [], n_rounds//2)
-    # Agent 2 goes first (roughly) half the time      
-    outcomes += [[b,a] for [a,b] in evaluate("connectx", [agent2, agent1], config, [], n_rounds-n_rounds//2)]
-    print("Agent 1 Win Percentage:", np.round(outcomes.count([1,-1])/len(outcomes), 2))
-    print("Agent 2 Win Percentage:", np.round(outcomes.count([-1,1])/len(outcomes), 2))
-    print("Number of Invalid Plays by Agent 1:", outcomes.count([None, 0]))
-    print("Number of Invalid Plays by Agent 2:", outcomes.count([0, None]))
+    config = DEFAULT_CONFIG
+    # Agents alternate going first; games are spread over a process pool
+    summary = run_tournament(agent1, agent2, n_rounds, config, workers=workers, seed=seed, time_limit=time_limit,
+                             record_path=record_path)
+    print("Agent 1 Win Percentage:", np.round(summary["win_rate"], 2), "95% CI", np.round(summary["win_rate_ci"], 2))
+    print("Agent 2 Win Percentage:", np.round(summary["loss_rate"], 2), "95% CI", np.round(summary["loss_rate_ci"], 2))
+    print("Draw Percentage:", np.round(summary["draw_rate"], 2))
+    print("Elo Difference (Agent 1 - Agent 2): %+.0f (95%% CI %+.0f to %+.0f)" % ((summary["elo"],) + summary["elo_ci"]))
+    print("Number of Invalid Plays by Agent 1:", summary["invalid"]["agent1"])
+    print("Number of Invalid Plays by Agent 2:", summary["invalid"]["agent2"])
+    print("Number of Timeouts by Agent 1:", summary["timeouts"]["agent1"])
+    print("Number of Timeouts by Agent 2:", summary["timeouts"]["agent2"])
+    print("Number of Errors by Agent 1:", summary["errors"]["agent1"])
+    print("Number of Errors by Agent 2:", summary["errors"]["agent2"])
+    return summary
 
 
 # get_win_percentages(agent1=agent, agent2="random", n_rounds=10)
 
 
 
-def play_connect_four(agent, rows=6, columns=7, inarow=4):
+def play_connect_four(agent, rows=6, columns=7, inarow=4, record_path=RECORDS_PATH):
     """
     Plays a Connect Four game against the specified agent.
 
@@ -192,6 +58,7 @@ def play_connect_four(agent, rows=6, columns=7, inarow=4):
         rows: Number of rows in the board.
         columns: Number of columns in the board.
         inarow: Number of pieces in a row to win.
+        record_path: game record store the finished game is appended to (None to skip it).
     """
 
     # Define a simple config object to pass to the agent
@@ -206,6 +73,7 @@ def play_connect_four(agent, rows=6, columns=7, inarow=4):
     game_over = False
     player_turn = 1  # User is player 1, agent is player 2
     mark = 1 # Current player's mark
+    moves, times = [], []  # Columns played and seconds per move, for the game record
 
     def print_board(board):
         """Prints the board to the console."""
@@ -222,6 +90,7 @@ def play_connect_four(agent, rows=6, columns=7, inarow=4):
         if player_turn == 1:  # User's turn
             valid_moves = get_valid_moves(board)
             col = -1
+            start = time.perf_counter()
             while col not in valid_moves:
                 try:
                     col = int(input(f"Your turn (Player 1), choose a column (0-{columns - 1}): "))
@@ -245,6 +114,7 @@ def play_connect_four(agent, rows=6, columns=7, inarow=4):
                     self.board = board
                     self.mark = mark
             obs = SimpleObs(board, 2)  # Create a simplified obs for the agent
+            start = time.perf_counter()
             col = agent(obs, config)
 
             print(f"Agent chooses column {col}")
@@ -254,6 +124,9 @@ def play_connect_four(agent, rows=6, columns=7, inarow=4):
                     board[row * columns + col] = 2
                     break
 
+        moves.append(col)
+        times.append(time.perf_counter() - start)
+
         # Check for win (simplified - you might want to use your check_win function)
         # Basic win check (can be expanded for full win conditions)
         for c in range(columns):
@@ -283,10 +156,12 @@ def play_connect_four(agent, rows=6, columns=7, inarow=4):
               print("You win!")
             else:
               print("Agent wins!")
+            record_game(moves, player_turn, ("human", agent_name(agent)), config, times, record_path)
         elif 0 not in board:
             print_board(board)
             print("It's a draw!")
             game_over = True
+            record_game(moves, 0, ("human", agent_name(agent)), config, times, record_path)
 
         player_turn = 3 - player_turn  # Switch turns (1 -> 2, 2 -> 1)
         mark = 3 - mark
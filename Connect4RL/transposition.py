@@ -0,0 +1,97 @@
+from collections import OrderedDict
+
+
+# Bound types stored with each value
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Rough size of one stored entry (key, value, depth, bound, move, generation) in CPython
+ENTRY_BYTES = 200
+
+
+class TranspositionTable:
+    """Cache of searched positions keyed by Zobrist hash.
+
+    Each entry stores (value, depth, bound, best move). The table never grows past
+    `megabytes`; when it is full the replacement policy decides what goes:
+
+    - "depth": fixed array indexed by hash; a slot is overwritten when the new entry
+      is at least as deep, or when the stored one comes from an older search.
+    - "lru": ordered dict that evicts the least recently used entry.
+    """
+
+    def __init__(self, megabytes=16, policy="depth"):
+        if policy not in ("depth", "lru"):
+            raise ValueError("policy must be 'depth' or 'lru', got %r" % (policy,))
+        self.policy = policy
+        self.capacity = max(1, int(megabytes * 2**20) // ENTRY_BYTES)
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        if self.policy == "depth":
+            self.slots = [None] * self.capacity
+        else:
+            self.slots = OrderedDict()
+        self.size = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # Marks the start of a new search so older entries become the first to be replaced
+    def new_search(self):
+        self.generation += 1
+
+    # Returns (value, depth, bound, move) or None
+    def probe(self, key):
+        self.probes += 1
+        if self.policy == "depth":
+            entry = self.slots[key % self.capacity]
+            if entry is None or entry[0] != key:
+                return None
+        else:
+            entry = self.slots.get(key)
+            if entry is None:
+                return None
+            self.slots.move_to_end(key)
+        self.hits += 1
+        return entry[1:5]
+
+    def store(self, key, value, depth, bound, move):
+        self.stores += 1
+        entry = (key, value, depth, bound, move, self.generation)
+        if self.policy == "depth":
+            index = key % self.capacity
+            old = self.slots[index]
+            if old is None:
+                self.size += 1
+            elif old[0] != key and old[2] > depth and old[5] == self.generation:
+                return
+            elif old[0] != key:
+                self.evictions += 1
+            self.slots[index] = entry
+        else:
+            if key in self.slots:
+                self.slots.move_to_end(key)
+            else:
+                self.size += 1
+                if self.size > self.capacity:
+                    self.slots.popitem(last=False)
+                    self.size -= 1
+                    self.evictions += 1
+            self.slots[key] = entry
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "capacity": self.capacity,
+            "entries": self.size,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate(),
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }